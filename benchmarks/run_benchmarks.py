@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the py4radiation pipeline on synthetic snapshots
+
+A cloud-in-wind snapshot is generated once per grid size (64^3 to
+512^3 cells) and every stage (loading, CLOUDS diagnostics and cuts,
+column density projections and outputs, and CIAOLoop parameter files)
+is timed on it. The wall time, throughput and peak memory of every stage are
+appended to a history file, and compared with the previous run, so
+that regressions show up from one commit to the next
+
+    python benchmarks/run_benchmarks.py --sizes 64 128 --repeat 3
+
+Stages whose dependencies are missing (e.g. yt and trident for the
+projections) are reported as skipped
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from py4radiation.simload import simload
+from py4radiation.snapshots import readsim
+from py4radiation.clouds.diagnose import Diagnose
+from py4radiation.radiation.parfiles import ParameterFiles
+from py4radiation.synthetic.column_density import column_densities, ColumnDensity
+from py4radiation.synthetic.spectral_cube import spectral_cube, LINES
+
+from snapshots import write_snapshot
+
+SIZES = [64, 128, 256, 512]
+
+class Skip(Exception):
+    None
+
+def bench_simload(ctx):
+    fields, _ = simload(ctx['simfile'])
+    for f in fields:
+        np.add.reduce(f, axis=None)
+
+def bench_readsim(ctx):
+    readsim(ctx['simfile'])
+
+def bench_diagnostics(ctx):
+    ctx['diagnose'].get_sim_diagnostics(ctx['fields'])
+
+def bench_cuts(ctx):
+    ctx['diagnose'].get_cuts(ctx['fields'], '0000')
+
+def bench_columns(ctx):
+    rho, tr1 = ctx['fields'][:2]
+    densities = {'H_p0': rho, 'O_p5': lambda k0, k1: rho[:, :, k0:k1] * tr1[:, :, k0:k1]}
+    column_densities(densities, ctx['shape'], [3.086e18] * 3)
+
+def column_maps(ctx):
+    if 'maps' not in ctx:
+        rho, tr1 = ctx['fields'][:2]
+        densities = {'H_p0': rho, 'O_p5': rho * tr1}
+
+        cols = ColumnDensity(None, ctx['shape'], np.array([['H', '1'], ['O', '6']]), densities=densities)
+        cols.maps = column_densities(densities, ctx['shape'], [3.086e18] * 3)
+        cols.obs = './'
+        ctx['maps'] = cols
+
+    return ctx['maps']
+
+def bench_column_text(ctx):
+    cols = column_maps(ctx)
+    cols.projXZ()
+    cols.projYZ()
+
+def bench_column_store(ctx):
+    column_maps(ctx).archive()
+
+def yt_dataset(ctx):
+    try:
+        import yt
+        import trident
+    except ImportError:
+        raise Skip('yt and trident are not installed')
+
+    if 'ds' not in ctx:
+        rho, tr1, prs, vx1, vx2, vx3 = ctx['fields']
+        shape = ctx['shape']
+        data  = {
+            ('gas', 'density'): (rho * 1e-24, 'g/cm**3'),
+            ('gas', 'temperature'): (prs / rho * 1e6, 'K'),
+            ('gas', 'metallicity'): (np.ones(shape), 'Zsun'),
+            ('gas', 'velocity_x'): (vx1 * 1e7, 'cm/s'),
+            ('gas', 'velocity_y'): (vx2 * 1e7, 'cm/s'),
+            ('gas', 'velocity_z'): (vx3 * 1e7, 'cm/s')
+        }
+        bbox = np.array([[-shape[0]/2, shape[0]/2], [0, shape[1]], [-shape[2]/2, shape[2]/2]])
+        ctx['ds'] = yt.load_uniform_grid(data, shape, length_unit=(3.086e18, 'cm'), bbox=bbox, nprocs=1)
+        trident.add_ion_fields(ctx['ds'], ions=['H', 'O'], ftype='gas')
+
+    return ctx['ds']
+
+def bench_projections(ctx, engine='native'):
+    cols = ColumnDensity(yt_dataset(ctx), ctx['shape'], np.array([['H', '1'], ['O', '6']]), engine)
+    cols.projXZ()
+    cols.projYZ()
+
+def bench_projections_yt(ctx):
+    bench_projections(ctx, 'yt')
+
+def bench_spectral_cube(ctx):
+    rho, tr1, prs, vx1, vx2, vx3 = ctx['fields']
+    spectral_cube(rho * tr1 * 1e-8, prs / rho * 1e6, vx2 * 1e7, 3.086e18, LINES['O VI'],
+                  np.arange(-500, 1, 5.0), 'voigt')
+
+def bench_parfiles(ctx):
+    parfiles = ParameterFiles('cloudy.exe', 'bench', 'H O', '0.0', 'HIGH')
+    parfiles.getIonFractions()
+    parfiles.getHeatingCooling()
+
+STAGES = [
+    ('simload', bench_simload),
+    ('readsim', bench_readsim),
+    ('diagnostics', bench_diagnostics),
+    ('cuts', bench_cuts),
+    ('columns', bench_columns),
+    ('column_text', bench_column_text),
+    ('column_store', bench_column_store),
+    ('projections', bench_projections),
+    ('projections_yt', bench_projections_yt),
+    ('spectral_cube', bench_spectral_cube),
+    ('parfiles', bench_parfiles)
+]
+
+GRIDLESS = ['parfiles']
+
+def measure(func, ctx, repeat):
+    """
+
+    Best and median wall time and peak traced memory of a stage
+
+    The stage is timed without tracing, which slows down allocations,
+    and run once more under tracemalloc for its memory
+
+    """
+    walls = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(ctx)
+        walls.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    try:
+        func(ctx)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {'best': min(walls), 'median': float(np.median(walls)), 'peak_mem': peak}
+
+def run_size(n, datadir, repeat, stages):
+    """
+
+    Run the benchmarks on an n^3 snapshot
+
+    """
+    shape   = (n, n, n)
+    simfile = os.path.join(datadir, 'data.%04d.vtk' % n)
+
+    if not os.path.isfile(simfile):
+        print('Generating %s' % simfile)
+        write_snapshot(simfile + '.tmp', shape)
+        os.replace(simfile + '.tmp', simfile)
+
+    fields, shape = readsim(simfile)
+    ctx = {
+        'simfile': simfile,
+        'shape': shape,
+        'fields': fields,
+        'diagnose': Diagnose(fields[:2], shape, [[-n/2, n/2], [-n/2, n/2], [-n/2, n/2]])
+    }
+
+    results = {}
+    for name, func in STAGES:
+        if stages and name not in stages:
+            continue
+
+        try:
+            result = measure(func, ctx, repeat)
+        except Skip as e:
+            print('  %-12s skipped (%s)' % (name, e))
+            continue
+
+        result['cells_per_s'] = n**3 / result['best'] if name not in GRIDLESS else None
+        results[name] = result
+        print('  %-12s %10.4f s  %10s cells/s  %8.1f MB' % (name, result['best'],
+                                                          '%.3e' % result['cells_per_s'] if result['cells_per_s'] else '-',
+                                                          result['peak_mem'] / 2**20))
+
+    return results
+
+def git_revision():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(results, history):
+    """
+
+    Print the change of every stage with respect to the last run that measured it
+
+    """
+    for n, stages in results.items():
+        for name, result in stages.items():
+            previous = None
+            for run in reversed(history):
+                if name in run['results'].get(n, {}):
+                    previous = run
+                    break
+
+            if previous is None:
+                continue
+
+            ratio = result['best'] / previous['results'][n][name]['best']
+            print('  %4s^3 %-12s x%.2f vs %s' % (n, name, ratio, previous['revision']))
+
+def main():
+    parser = argparse.ArgumentParser(description='py4radiation benchmarks on synthetic snapshots')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES[:2], help='cells per side of the snapshots')
+    parser.add_argument('--repeat', type=int, default=3, help='repetitions of every stage')
+    parser.add_argument('--stages', nargs='+', help='stages to run (default: all)')
+    parser.add_argument('--data', default=os.path.join(ROOT, 'benchmarks', 'data'), help='directory of the snapshots')
+    parser.add_argument('--history', default=os.path.join(ROOT, 'benchmarks', 'history.json'),
+                        help='history file of the results')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.data):
+        None
+    else:
+        os.makedirs(args.data)
+
+    history = []
+    if os.path.isfile(args.history):
+        with open(args.history) as f:
+            history = json.load(f)
+
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='py4radiation_bench_')
+    os.chdir(workdir)
+    os.mkdir('./observables/')
+
+    results = {}
+    try:
+        for n in args.sizes:
+            print('%d^3 cells' % n)
+            results[str(n)] = run_size(n, os.path.abspath(os.path.join(cwd, args.data)), args.repeat, args.stages)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+    compare(results, history)
+
+    history.append({
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'revision': git_revision(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpus': os.cpu_count(),
+        'repeat': args.repeat,
+        'results': results
+    })
+
+    tmp = args.history + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(history, f, indent=1)
+    os.replace(tmp, args.history)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Synthetic PLUTO-style snapshots for the benchmarks: a spherical
+cloud with a passive tracer embedded in a uniform wind, written as
+binary legacy VTK files like the ones PLUTO produces.
+"""
+
+import numpy as np
+
+VAR_NAMES = ['rho', 'tr1', 'prs', 'vx1', 'vx2', 'vx3']
+
+def cloud_in_wind(shape, k0, k1, chi=100.0, radius=None, vwind=1.0, prs=1.0, seed=0):
+    """
+
+    Fields of a cloud-in-wind set-up on the z-slab [k0, k1)
+
+    **Parameters**
+
+    :shape: tuple, cells along x, y, z
+
+    :k0: int, first z-plane of the slab
+
+    :k1: int, last z-plane of the slab (excluded)
+
+    :chi: float, optional, cloud-to-wind density contrast
+
+    :radius: float, optional, cloud radius in cells (default: shape[0] / 8)
+
+    :vwind: float, optional, wind speed along y
+
+    :prs: float, optional, uniform pressure
+
+    :seed: int, optional, seed of the velocity perturbations
+
+    :return: list of float32 arrays (rho, tr1, prs, vx1, vx2, vx3)
+
+    """
+    nx, ny, nz = shape
+    if radius is None:
+        radius = nx / 8
+
+    x = (np.arange(nx) - nx / 2 + 0.5).reshape(-1, 1, 1)
+    y = (np.arange(ny) - ny / 4 + 0.5).reshape(1, -1, 1)
+    z = (np.arange(k0, k1) - nz / 2 + 0.5).reshape(1, 1, -1)
+
+    r   = np.sqrt(x**2 + y**2 + z**2)
+    tr1 = 0.5 * (1 - np.tanh((r - radius) / 2))
+    rho = 1 + (chi - 1) * tr1
+
+    rng = np.random.default_rng(seed + k0)
+    vx1 = 0.01 * vwind * rng.standard_normal(r.shape)
+    vx2 = vwind * (1 - tr1) + 0.01 * vwind * rng.standard_normal(r.shape)
+    vx3 = 0.01 * vwind * rng.standard_normal(r.shape)
+
+    return [a.astype(np.float32) for a in [rho, tr1, np.full(r.shape, prs), vx1, vx2, vx3]]
+
+def write_snapshot(filename, shape, slab=16, **kwargs):
+    """
+
+    Write a synthetic snapshot as a binary legacy VTK file,
+    generating it in z-slabs so that memory stays bounded; the fields
+    of every slab are generated once and written into the blocks of
+    the six arrays
+
+    :filename: string
+
+    :shape: tuple, cells along x, y, z
+
+    :slab: int, optional, z-planes generated at a time
+
+    """
+    nx, ny, nz = shape
+
+    with open(filename, 'wb') as f:
+        f.write(b'# vtk DataFile Version 2.0\nPLUTO 4.4 VTK Data\nBINARY\nDATASET RECTILINEAR_GRID\n')
+        f.write(b'FIELD FieldData 1\nTIME 1 1 double\n')
+        f.write(np.array([0.0], dtype='>f8').tobytes())
+        f.write(b'\n')
+        f.write(b'DIMENSIONS %d %d %d\n' % (nx + 1, ny + 1, nz + 1))
+
+        for axis, n in zip(b'XYZ', shape):
+            f.write(b'%c_COORDINATES %d float\n' % (axis, n + 1))
+            f.write((np.arange(n + 1) - n / 2).astype('>f4').tobytes())
+            f.write(b'\n')
+
+        f.write(b'CELL_DATA %d\n' % (nx * ny * nz))
+
+        nbytes  = 4 * nx * ny * nz
+        offsets = []
+        for name in VAR_NAMES:
+            f.write(b'SCALARS %s float\nLOOKUP_TABLE default\n' % name.encode())
+            offsets.append(f.tell())
+            f.seek(nbytes, 1)
+            f.write(b'\n')
+
+        for k0 in range(0, nz, slab):
+            fields = cloud_in_wind(shape, k0, min(k0 + slab, nz), **kwargs)
+            for offset, field in zip(offsets, fields):
+                f.seek(offset + 4 * nx * ny * k0)
+                f.write(field.astype('>f4').tobytes(order='F'))
@@ -6,10 +6,30 @@ Please visit our research group's website:
 https://cphysplus.github.io/
 """
 
+import time
+_start = time.perf_counter()
+
+import importlib
+
 from .simload import simload
-from radiation.prepare_sed import SED
-from radiation.parfiles import ParameterFiles
-from synthetic.observables import SyntheticObservables
-from clouds.diagnose import Diagnose
 
-__all__ = ['main', 'simload']
\ No newline at end of file
+_lazy = {
+    'SED': '.radiation.prepare_sed',
+    'ParameterFiles': '.radiation.parfiles',
+    'SyntheticObservables': '.synthetic.observables',
+    'Diagnose': '.clouds.diagnose'
+}
+
+def __getattr__(name):
+    """
+
+    Import the radiation, synthetic and clouds subsystems
+    (and their heavy dependencies) only on first use
+
+    """
+    if name in _lazy:
+        return getattr(importlib.import_module(_lazy[name], __name__), name)
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+__all__ = ['main', 'simload', 'SED', 'ParameterFiles', 'SyntheticObservables', 'Diagnose']
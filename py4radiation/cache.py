@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import shutil
+import hashlib
+from contextlib import contextmanager
+
+from .vtkfile import VTKFile
+from .chunkstore import ChunkStore
+
+def parse_size(size):
+    """
+
+    Convert a size such as 500M, 20G or 1048576 into bytes
+
+    :size: string or int
+
+    """
+    if size is None:
+        return None
+
+    size  = str(size).strip().upper().rstrip('B')
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+
+    return int(size)
+
+def content_hash(filename, blocksize=2**24):
+    """
+
+    BLAKE2 hash of the content of a file
+
+    :filename: string
+
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+class SnapshotCache():
+    """
+
+    On-disk cache of converted simulation snapshots
+
+    Each snapshot is stored as a ChunkStore with one array per field,
+    addressed by the hash of the content of the simulation file. Snapshots
+    whose path, size and modification time are unchanged are found without
+    hashing them again. The least recently used snapshots are evicted
+    when the cache grows above its size cap
+
+    Several processes can share a cache: the index is only updated under
+    a lock file, snapshots used in the last grace seconds are not
+    evicted, and a snapshot evicted while it is being loaded is
+    converted again
+
+    :path: string
+
+        Directory of the cache
+
+    :maxsize: string or int, optional
+
+        Size cap of the cache (e.g. 50G), no cap by default
+
+    :compression: string, optional
+
+        None (default, memory-mapped loads) or zlib
+
+    :chunk: int, optional
+
+        Thickness in cells of the z-slab chunks of compressed snapshots
+
+    :grace: float, optional
+
+        Seconds after its last use during which a snapshot is not evicted
+
+    """
+
+    stale = 60.0   # seconds after which the lock of a dead process is broken
+
+    def __init__(self, path, maxsize=None, compression=None, chunk=16, grace=10.0):
+        self.path        = path
+        self.maxsize     = parse_size(maxsize)
+        self.compression = compression
+        self.chunk       = chunk
+        self.grace       = grace
+
+        if os.path.isdir(path):
+            None
+        else:
+            os.makedirs(path)
+
+        self.index_file = os.path.join(path, 'index.json')
+
+    def _load_index(self):
+        if os.path.isfile(self.index_file):
+            with open(self.index_file) as f:
+                return json.load(f)
+
+        return {}
+
+    def _save_index(self, index):
+        tmp = self.index_file + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, self.index_file)
+
+    @contextmanager
+    def _locked(self):
+        """
+
+        Hold the lock of the index (O_CREAT | O_EXCL lock file), breaking
+        the lock of a process that died holding it
+
+        """
+        lock = self.index_file + '.lock'
+        while True:
+            try:
+                fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.stat(lock).st_mtime > self.stale:
+                        os.remove(lock)
+                        continue
+                except FileNotFoundError:
+                    continue
+                time.sleep(0.01)
+
+        os.close(fd)
+        try:
+            yield
+        finally:
+            os.remove(lock)
+
+    def _complete(self, key):
+        return os.path.isfile(os.path.join(self.path, key, 'index.json'))
+
+    def key(self, filename, index=None):
+        """
+
+        Content key of a simulation file
+
+        :filename: string
+
+        """
+        if index is None:
+            index = self._load_index()
+
+        path = os.path.abspath(filename)
+        stat = os.stat(filename)
+
+        for key, entry in index.items():
+            if entry['path'] == path and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+                return key
+
+        return content_hash(filename)
+
+    def get(self, filename, key=None):
+        """
+
+        Cached store of a simulation file, None if it is not in the cache
+
+        :filename: string
+
+        :key: string, optional
+
+            Content key of the file, computed if not given
+
+        """
+        if key is None:
+            key = self.key(filename)
+
+        stat = os.stat(filename)
+        with self._locked():
+            index = self._load_index()
+            if key not in index or not self._complete(key):
+                return None
+
+            index[key].update(path=os.path.abspath(filename), size=stat.st_size,
+                              mtime=stat.st_mtime_ns, atime=time.time())
+            self._save_index(index)
+
+        return ChunkStore(os.path.join(self.path, key))
+
+    def put(self, filename, key=None):
+        """
+
+        Convert a simulation file and add it to the cache
+
+        :filename: string
+
+        :key: string, optional
+
+            Content key of the file, computed if not given
+
+        """
+        if key is None:
+            key = content_hash(filename)
+
+        stat = os.stat(filename)
+        dest = os.path.join(self.path, key)
+
+        if self._complete(key):
+            None
+        else:
+            vtkfile = VTKFile(filename)
+            tmp = dest + '.' + str(os.getpid()) + '.tmp'
+
+            store = ChunkStore(tmp, self.compression)
+
+            for name in vtkfile.arrays:
+                field = vtkfile.field(name)
+
+                # z-slab chunks, whole along x, y and the components of vectors
+                if self.compression:
+                    chunks = field.shape[:-1] + (self.chunk,)
+                else:
+                    chunks = None
+
+                store.write(name, field, chunks, {'shape': list(vtkfile.shape)})
+
+            if os.path.isdir(dest) and not self._complete(key):
+                shutil.rmtree(dest, ignore_errors=True)
+
+            try:
+                os.rename(tmp, dest)
+            except OSError:
+                shutil.rmtree(tmp, ignore_errors=True)
+
+        store = ChunkStore(dest)
+
+        with self._locked():
+            index = self._load_index()
+            index[key] = {
+                'path': os.path.abspath(filename),
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+                'nbytes': store.nbytes(),
+                'atime': time.time()
+            }
+            self._save_index(index)
+
+        self.prune(keep=key)
+
+        return store
+
+    def load(self, filename, fields, box=None):
+        """
+
+        Load fields of a simulation file through the cache,
+        converting the file on a miss
+
+        :filename: string
+
+        :fields: list of strings
+
+        :box: tuple of slices or list of [start, stop] index pairs, optional
+
+        :return: fields, shape (of the sub-box)
+
+        """
+        slices = []
+        for lims in (box if box is not None else [None] * 3):
+            if lims is None or isinstance(lims, slice):
+                slices.append(lims if lims is not None else slice(None))
+            else:
+                slices.append(slice(int(lims[0]), int(lims[1])))
+
+        key = self.key(filename)
+        for attempt in range(3):
+            store = self.get(filename, key)
+            if store is None:
+                store = self.put(filename, key)
+
+            try:
+                data = [store.read(name, tuple(slices)) for name in fields]
+                break
+            except (FileNotFoundError, KeyError):
+                # evicted by another process in the meantime: convert again
+                if attempt == 2:
+                    raise
+
+        return data, data[0].shape
+
+    def warm(self, filenames):
+        """
+
+        Convert simulation files that are not in the cache yet
+
+        :filenames: list of strings
+
+        """
+        for filename in filenames:
+            key = self.key(filename)
+            if self.get(filename, key) is None:
+                self.put(filename, key)
+                print(f'Cached {filename}')
+
+    def prune(self, maxsize=None, keep=None):
+        """
+
+        Evict the least recently used snapshots until the cache
+        fits in its size cap and drop stale entries
+
+        :maxsize: string or int, optional
+
+            Size cap (default: the size cap of the cache)
+
+        :keep: string, optional
+
+            Key that must not be evicted (e.g. a snapshot being loaded)
+
+        :return: list of evicted keys
+
+        """
+        maxsize = parse_size(maxsize) if maxsize is not None else self.maxsize
+
+        with self._locked():
+            index   = self._load_index()
+            evicted = [key for key in index if not self._complete(key)]
+
+            for key in evicted:
+                del index[key]
+
+            if maxsize is not None:
+                total = sum(entry['nbytes'] for entry in index.values())
+                for key in sorted(index, key=lambda k: index[k]['atime']):
+                    if total <= maxsize:
+                        break
+                    if key == keep or time.time() - index[key]['atime'] < self.grace:
+                        continue
+
+                    # move aside first, so that readers never see a partial snapshot
+                    dest  = os.path.join(self.path, key)
+                    moved = dest + '.' + str(os.getpid()) + '.evicted'
+                    try:
+                        os.rename(dest, moved)
+                    except OSError:
+                        None
+                    shutil.rmtree(moved, ignore_errors=True)
+
+                    total -= index[key]['nbytes']
+                    del index[key]
+                    evicted.append(key)
+
+            self._save_index(index)
+
+        return evicted
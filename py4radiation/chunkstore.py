@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import zlib
+import itertools
+import numpy as np
+
+class ChunkStore():
+    """
+
+    Columnar store of named arrays split into (optionally compressed) chunks
+
+    Every array is written to its own data file (or to the single data
+    file of the store) as a sequence of chunks in Fortran order and
+    described in a JSON index with its dtype, shape, chunk shape, byte
+    offsets and attributes. Reading a sub-box only decodes the chunks
+    that intersect it, and uncompressed single-chunk arrays are
+    memory-mapped
+
+    :path: string
+
+        Directory of the store, created if it does not exist
+
+    :compression: string, optional
+
+        None (default) or zlib
+
+    :level: int, optional
+
+        Compression level
+
+    :datafile: string, optional
+
+        Name of a single data file for all the arrays, to which new
+        arrays are appended (default: one data file per array). A
+        rewritten array leaves its old chunks unreferenced in the file
+
+    """
+
+    def __init__(self, path, compression=None, level=1, datafile=None):
+        if compression not in (None, 'zlib'):
+            raise Exception('Compression must be None or zlib')
+
+        self.path        = path
+        self.compression = compression
+        self.level       = level
+        self.datafile    = datafile
+
+        if os.path.isdir(path):
+            None
+        else:
+            os.makedirs(path)
+
+        self.index_file = os.path.join(path, 'index.json')
+
+        if os.path.isfile(self.index_file):
+            with open(self.index_file) as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def names(self):
+        """
+
+        Names of the arrays in the store
+
+        """
+        return list(self.index)
+
+    def shape(self, name):
+        """
+
+        Shape of an array in the store
+
+        """
+        return tuple(self.index[name]['shape'])
+
+    def attrs(self, name):
+        """
+
+        Attributes (metadata) of an array in the store
+
+        """
+        return self.index[name]['attrs']
+
+    def nbytes(self):
+        """
+
+        Size of the data files of the store in bytes
+
+        """
+        return sum(os.path.getsize(f) for f in set(self._datafile(name) for name in self.index))
+
+    def flush(self):
+        """
+
+        Write the index atomically to disk
+
+        """
+        tmp = self.index_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.index_file)
+
+    def _datafile(self, name):
+        if name in self.index and 'file' in self.index[name]:
+            return os.path.join(self.path, self.index[name]['file'])
+        if self.datafile is not None:
+            return os.path.join(self.path, self.datafile)
+
+        return os.path.join(self.path, name.replace('/', '__') + '.bin')
+
+    def _write_chunk(self, f, block, dtype):
+        """
+
+        Write a chunk slab by slab along its last axis, so that
+        memory-mapped inputs are never fully copied into memory
+
+        """
+        offset = f.tell()
+        step   = max(1, 2**24 // max(1, int(np.prod(block.shape[:-1])) * dtype.itemsize))
+        comp   = zlib.compressobj(self.level) if self.compression else None
+
+        for k in range(0, max(block.shape[-1], 1), step):
+            data = np.asarray(block[..., k:k + step], dtype=dtype).tobytes(order='F')
+            if comp:
+                data = comp.compress(data)
+            f.write(data)
+
+        if comp:
+            f.write(comp.flush())
+
+        return [offset, f.tell() - offset]
+
+    def write(self, name, array, chunks=None, attrs=None):
+        """
+
+        Write an array, replacing any array with the same name
+
+        :name: string
+
+        :array: numpy array
+
+        :chunks: tuple, optional
+
+            Chunk shape (default: the whole array as a single chunk)
+
+        :attrs: dict, optional
+
+            JSON-serialisable metadata
+
+        """
+        shape  = tuple(int(n) for n in np.shape(array))
+        dtype  = np.dtype(array.dtype).newbyteorder('=')
+        chunks = shape if chunks is None else tuple(min(int(c), n) for c, n in zip(chunks, shape))
+
+        if self.datafile is not None:
+            datafile, mode = self.datafile, 'ab'
+        else:
+            datafile, mode = name.replace('/', '__') + '.bin', 'wb'
+
+        table = {}
+        with open(os.path.join(self.path, datafile), mode) as f:
+            grid = [range(0, n, c) for n, c in zip(shape, chunks)]
+            for start in itertools.product(*grid):
+                sl = tuple(slice(s, s + c) for s, c in zip(start, chunks))
+                key = '.'.join(str(s // c) for s, c in zip(start, chunks))
+                table[key] = self._write_chunk(f, array[sl], dtype)
+
+        self.index[name] = {
+            'dtype': dtype.str,
+            'shape': list(shape),
+            'chunks': list(chunks),
+            'compression': self.compression,
+            'table': table,
+            'attrs': attrs if attrs is not None else {}
+        }
+        if self.datafile is not None:
+            self.index[name]['file'] = datafile
+        self.flush()
+
+    def append(self, name, frame, attrs=None):
+        """
+
+        Append a frame along a new leading (time) axis,
+        stored as a chunk of its own
+
+        :name: string
+
+        :frame: numpy array
+
+        :attrs: dict, optional
+
+            Metadata of the frame, appended to the list of
+            frame attributes of the array
+
+        """
+        dtype = np.dtype(frame.dtype).newbyteorder('=')
+        shape = [int(n) for n in np.shape(frame)]
+
+        if name not in self.index:
+            self.index[name] = {
+                'dtype': dtype.str,
+                'shape': [0] + shape,
+                'chunks': [1] + shape,
+                'compression': self.compression,
+                'table': {},
+                'attrs': {'frames': []}
+            }
+            if self.datafile is not None:
+                self.index[name]['file'] = self.datafile
+            else:
+                open(self._datafile(name), 'wb').close()
+
+        entry = self.index[name]
+        if entry['shape'][1:] != shape:
+            raise Exception('Frame shape ' + str(shape) + ' does not match ' + name)
+
+        with open(self._datafile(name), 'ab') as f:
+            key = '.'.join([str(entry['shape'][0])] + ['0'] * len(shape))
+            entry['table'][key] = self._write_chunk(f, frame, np.dtype(entry['dtype']))
+
+        entry['shape'][0] += 1
+        entry['attrs']['frames'].append(attrs if attrs is not None else {})
+        self.flush()
+
+    def replace(self, name, t, frame, attrs=None):
+        """
+
+        Replace a frame of an array written with append; the new
+        chunk is appended to the data file and the old one is
+        left unreferenced
+
+        :name: string
+
+        :t: int, index of the frame along the leading axis
+
+        :frame: numpy array
+
+        :attrs: dict, optional, metadata of the frame
+
+        """
+        entry = self.index[name]
+        shape = [int(n) for n in np.shape(frame)]
+        if entry['shape'][1:] != shape:
+            raise Exception('Frame shape ' + str(shape) + ' does not match ' + name)
+
+        with open(self._datafile(name), 'ab') as f:
+            key = '.'.join([str(t)] + ['0'] * len(shape))
+            entry['table'][key] = self._write_chunk(f, frame, np.dtype(entry['dtype']))
+
+        entry['attrs']['frames'][t] = attrs if attrs is not None else {}
+        self.flush()
+
+    def _read_chunk(self, f, entry, key, shape):
+        offset, nbytes = entry['table'][key]
+        f.seek(offset)
+        data = f.read(nbytes)
+
+        if entry['compression']:
+            data = zlib.decompress(data)
+
+        return np.frombuffer(data, dtype=entry['dtype']).reshape(shape, order='F')
+
+    def read(self, name, box=None):
+        """
+
+        Read an array or a sub-box of it
+
+        :name: string
+
+        :box: tuple of slices or ints, optional
+
+            Sub-box to read (default: the whole array); only the chunks
+            intersecting it are read and decoded
+
+        :return: numpy array (a read-only memmap for uncompressed
+                 single-chunk arrays)
+
+        """
+        entry  = self.index[name]
+        shape  = tuple(entry['shape'])
+        chunks = tuple(entry['chunks'])
+
+        if box is None:
+            box = ()
+        if not isinstance(box, tuple):
+            box = (box,)
+        box = box + (slice(None),) * (len(shape) - len(box))
+
+        if entry['compression'] is None and chunks == shape:
+            offset = entry['table'].get('.'.join(['0'] * len(shape)), [0])[0]
+            data = np.memmap(self._datafile(name), dtype=entry['dtype'], mode='r',
+                             offset=offset, shape=shape, order='F')
+            return data[box]
+
+        # strided boxes are read over the contiguous range covering them
+        slices = []
+        strides = []
+        for b, n in zip(box, shape):
+            if isinstance(b, slice):
+                r = range(*b.indices(n))
+                if len(r) == 0:
+                    slices.append(slice(0, 0))
+                    strides.append(slice(None))
+                    continue
+
+                lo = min(r[0], r[-1])
+                stop = r[-1] - lo + (1 if r.step > 0 else -1)
+                slices.append(slice(lo, max(r[0], r[-1]) + 1))
+                strides.append(slice(r[0] - lo, stop if stop >= 0 else None, r.step))
+            else:
+                b = int(b) % n
+                slices.append(slice(b, b + 1))
+                strides.append(slice(None))
+
+        out = np.empty(tuple(sl.stop - sl.start for sl in slices), dtype=entry['dtype'], order='F')
+
+        with open(self._datafile(name), 'rb') as f:
+            grid = [range(sl.start // c, (sl.stop - 1) // c + 1) if sl.stop > sl.start else range(0)
+                    for sl, c in zip(slices, chunks)]
+            for idx in itertools.product(*grid):
+                start = [i * c for i, c in zip(idx, chunks)]
+                cshape = tuple(min(c, n - s) for c, n, s in zip(chunks, shape, start))
+                block = self._read_chunk(f, entry, '.'.join(map(str, idx)), cshape)
+
+                src = []
+                dst = []
+                for sl, s, c in zip(slices, start, cshape):
+                    lo = max(sl.start, s)
+                    hi = min(sl.stop, s + c)
+                    src.append(slice(lo - s, hi - s))
+                    dst.append(slice(lo - sl.start, hi - sl.start))
+
+                out[tuple(dst)] = block[tuple(src)]
+
+        if any(st != slice(None) for st in strides):
+            out = out[tuple(strides)]
+
+        squeeze = tuple(i for i, b in enumerate(box) if not isinstance(b, slice))
+        return out.squeeze(axis=squeeze) if squeeze else out
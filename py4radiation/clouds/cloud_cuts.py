@@ -3,11 +3,16 @@
 import os
 import numpy as np
 
+from ..profiling import profiled
+
 class CloudCuts():
     """
 
     Create velocity and number density cuts from a VTK simulation file
 
+    The raw fields are sliced first and every quantity is derived on
+    the 2D planes only, so taking several cuts costs little more than one
+
     :fields: numpy array
 
         Scalar/vector fields from a VTK simulation file
@@ -16,50 +21,118 @@ class CloudCuts():
 
         Shape of the computational box of the simulation file
 
+    :nsim: string
+
+        Number of the simulation to label output files
+
+    :planes: list, optional
+
+        (axis, index) pairs of the cuts, axis x, y or z
+        (default: the z mid-plane)
+
+    :quantities: list, optional
+
+        Quantities to cut (default: n, v)
+        n: number density, v: velocity magnitude,
+        ntr: tracer-weighted number density, T: temperature
+
+    :outdir: string, optional
+
+        Directory of the text cuts (default: ./clouds/)
+
     """
 
-    def __init__(self, fields, shape, nsim):
-        self.nsim = nsim
-        rho, _, _, vx, vy, vz = fields
-        self.rho = rho
-        self.v   = np.sqrt(vx**2 + vy**2 + vz**2)
+    mu = 0.6724418
+    mm = 1.660e-24
+    kb = 1.380e-16
+
+    units = {'n': 'cm^-3', 'v': 'code velocity', 'ntr': 'cm^-3', 'T': 'K'}
 
+    def __init__(self, fields, shape, nsim, planes=None, quantities=None, outdir='./clouds/'):
+        self.nsim = nsim
         self.cut = int((shape[2] / 2) - 1)
 
-        self.clouds = './clouds/'
+        if planes is None:
+            planes = [('z', self.cut)]
+        if quantities is None:
+            quantities = ['n', 'v']
+
+        for q in quantities:
+            if q not in self.units:
+                raise Exception('Cut quantities: n, v, ntr, T')
+
+        self.fields     = fields
+        self.planes     = [(axis, int(index)) for axis, index in planes]
+        self.quantities = quantities
 
-        if os.path.isdir('./clouds/'):
-            None
-        else:
-            os.mkdir('./clouds/')
+        self.clouds = outdir
 
-    def get_ncuts(self):
+        os.makedirs(self.clouds, exist_ok=True)
+
+    def _plane(self, axis, index):
         """
 
-        Get a number density cut of a single simulation file
+        Derive all the quantities on a single plane
 
         """
-        mu = 0.6724418
-        mm = 1.660e-24
+        sl = [slice(None)] * 3
+        sl['xyz'.index(axis)] = index
+        sl = tuple(sl)
+
+        rho, tr1, prs, vx, vy, vz = self.fields
+        rho = np.asarray(rho[sl], dtype=np.float64)
+
+        cuts = {}
+        for q in self.quantities:
+            if q == 'n':
+                cuts[q] = rho / (self.mm * self.mu)
+            elif q == 'v':
+                cuts[q] = np.sqrt(vx[sl].astype(np.float64)**2 + vy[sl].astype(np.float64)**2
+                                  + vz[sl].astype(np.float64)**2)
+            elif q == 'ntr':
+                cuts[q] = rho * tr1[sl] / (self.mm * self.mu)
+            elif q == 'T':
+                cuts[q] = prs[sl] * self.mm * self.mu / (rho * self.kb)
+
+        return cuts
+
+    def _name(self, q, axis, index):
+        if len(self.planes) == 1:
+            return q
+
+        return q + '_' + axis + str(index)
+
+    @profiled('cuts')
+    def get_planes(self):
+        """
 
-        n = self.rho / (mm * mu)
-        nz0 = n[:, :, self.cut]
+        Get every cut with its metadata, for a CutStore
 
-        nfile = self.clouds + 'ncut_' + self.nsim + '.dat'
-        n_arr = '\n'.join(['\t'.join(map(str, row)) for row in nz0])
-        with open(nfile, 'w') as fn:
-            fn.write(n_arr)
+        :return: list of (name, 2D numpy array, metadata dict)
 
-    def get_vcuts(self):
         """
+        planes = []
+        for axis, index in self.planes:
+            cuts = self._plane(axis, index)
+            for q in self.quantities:
+                meta = {'quantity': q, 'axis': axis, 'index': index, 'units': self.units[q]}
+                planes.append((self._name(q, axis, index), cuts[q], meta))
+
+        return planes
 
-        Get a velocity cut of a single simulation file
-        
+    @profiled('cuts_text')
+    def get_textcuts(self):
         """
-        v = self.v
-        vz0 = v[:, :, self.cut]
 
-        vfile = self.clouds + 'vcut_' + self.nsim + '.dat'
-        v_arr = '\n'.join(['\t'.join(map(str, row)) for row in vz0])
-        with open(vfile, 'w') as fv:
-            fv.write(v_arr)
\ No newline at end of file
+        Write every cut of a single simulation file as a text file
+
+        """
+        for _, arr, meta in self.get_planes():
+            cfile = self.clouds + meta['quantity'] + 'cut_'
+            if len(self.planes) > 1:
+                cfile += meta['axis'] + str(meta['index']) + '_'
+            cfile += self.nsim + '.dat'
+
+            c_arr = '\n'.join(['\t'.join(map(str, row)) for row in arr])
+            with open(cfile, 'w') as fc:
+                fc.write(c_arr)
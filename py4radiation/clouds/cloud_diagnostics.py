@@ -1,6 +1,7 @@
 #/usr/bin/env python3
 
-import numpy as np
+from ..profiling import profiled
+from .moments import CloudMoments
 
 class CloudDiagnostics():
     """
@@ -19,16 +20,24 @@ class CloudDiagnostics():
 
         Initial mass of the cloud
 
+    :block: int, optional
+
+        Number of z-planes per slab of the moment pass
+        (default: about 2^20 cells per slab)
+
+    :dtype: string, optional
+
+        float64 (default) or float32 accumulation
+
     """
 
-    def __init__(self, j3D, dV, M0):
+    def __init__(self, j3D, dV, M0, block=None, dtype='float64'):
         self.j3D = j3D
         self.dV  = dV
         self.M0  = M0
-        
-        self.mu = 0.6724418
-        self.mm = 1.660e-24
-        self.kb = 1.380e-16
+
+        self.block = block
+        self.dtype = dtype
 
     def diagnose(self, fields):
         """
@@ -41,43 +50,32 @@ class CloudDiagnostics():
             
         """
 
-        rho, tr1, prs, vx, vy, vz = fields
+        shape = fields[0].shape
 
-        n = rho * tr1 / (self.mm * self.mu)
-        T = prs * tr1 / (n * self.kb)
-        v = np.sqrt(vx**2 + vy**2 + vz**2) * tr1
+        block = self.block
+        if block is None:
+            block = max(1, 2**20 // (shape[0] * shape[1]))
 
-        M = np.sum(rho * tr1) * self.dV
-        
-        def mwav(var):
-            return np.sum(rho * var * tr1) * self.dV / M
+        slabs = ((k0, [f[:, :, k0:k0 + block] for f in fields]) for k0 in range(0, shape[2], block))
 
-        n_av = mwav(n)
-        T_av = mwav(T)
-        y_cm = mwav(self.j3D[1])
+        return self.diagnose_slabs(slabs)
 
-        mask = np.where((tr1 >= 0.01) & (tr1 <= 0.99), tr1, 0)
-        fmix = np.sum(rho * mask) * self.dV / self.M0
+    @profiled('diagnose')
+    def diagnose_slabs(self, slabs):
+        """
 
-        def sigma(var):
-            s  = mwav(var)
-            s2 = mwav(var**2)
+        Diagnose a VTK file streamed in z-slabs
 
-            if np.isnan(s):
-                sg = np.sqrt(s2)
-            else:
-                sg = np.sqrt(s2 - s**2)
-            
-            return sg
+        :slabs: iterable
+
+            (index of the first z-plane, fields on the slab) pairs
+
+        """
+        moments = CloudMoments(self.j3D, self.dtype)
 
-        x_sg = sigma(self.j3D[0]) * np.sqrt(5)
-        y_sg = sigma(self.j3D[1]) * np.sqrt(5)
-        z_sg = sigma(self.j3D[2]) * np.sqrt(5)
-        j_sg = [x_sg, y_sg, z_sg]
+        for k0, fields in slabs:
+            moments.add(fields, k0)
 
-        vx_sg = sigma(vx)
-        vy_sg = sigma(vy)
-        vz_sg = sigma(vz)
-        v_sg = [vx_sg, vy_sg, vz_sg]
+        self.profiles = moments.profiles(self.dV)
 
-        return n_av, T_av, fmix, y_cm, j_sg, v_sg
\ No newline at end of file
+        return moments.result(self.dV, self.M0)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+from ..chunkstore import ChunkStore
+from ..profiling import profiled
+
+class CutStore():
+    """
+
+    Binary time-series store of the cuts of a simulation
+
+    Every quantity is kept as a single (time, nx, ny) array in a
+    ChunkStore, one chunk per snapshot, so any snapshot can be read
+    without decoding the others. Each frame records its snapshot number,
+    cut axis and index, and units. A snapshot processed again replaces
+    its frames, so the time axis holds every snapshot once
+
+    :path: string
+
+        Directory of the store
+
+    :compression: string, optional
+
+        None (default) or zlib
+
+    """
+
+    def __init__(self, path, compression=None):
+        self.store = ChunkStore(path, compression)
+
+    @profiled('cutstore')
+    def add(self, sinnum, planes):
+        """
+
+        Append the cuts of a snapshot
+
+        :sinnum: string
+
+            Number of the simulation
+
+        :planes: list
+
+            (quantity, 2D numpy array, metadata dict) for every cut
+
+        """
+        for name, plane, attrs in planes:
+            attrs = dict(attrs, snapshot=sinnum)
+            if name in self.store and sinnum in self.snapshots(name):
+                self.store.replace(name, self._frame(name, sinnum), plane, attrs)
+            else:
+                self.store.append(name, plane, attrs)
+
+    def quantities(self):
+        """
+
+        Names of the stored quantities
+
+        """
+        return self.store.names()
+
+    def snapshots(self, name):
+        """
+
+        Snapshot numbers of the frames of a quantity, in time order
+
+        """
+        return [frame['snapshot'] for frame in self.store.attrs(name)['frames']]
+
+    def _frame(self, name, sinnum):
+        """
+
+        Time index of the frame of a snapshot
+
+        """
+        snapshots = self.snapshots(name)
+        return len(snapshots) - 1 - snapshots[::-1].index(sinnum)
+
+    def metadata(self, name, t):
+        """
+
+        Metadata of a single frame
+
+        :name: string, quantity
+
+        :t: int (time index) or string (snapshot number)
+
+        """
+        if isinstance(t, str):
+            t = self._frame(name, t)
+
+        return self.store.attrs(name)['frames'][t]
+
+    def read(self, name, t=None):
+        """
+
+        Read the cuts of a quantity
+
+        :name: string, quantity
+
+        :t: int (time index), string (snapshot number) or slice, optional
+
+            Frames to read (default: all, as a (time, nx, ny) array)
+
+        """
+        if isinstance(t, str):
+            t = self._frame(name, t)
+
+        return self.store.read(name, t)
@@ -3,6 +3,8 @@
 import os
 import numpy as np
 
+from ..vtkfile import VTKFile
+from ..simload import VAR_NAMES
 from .cloud_cuts import CloudCuts
 from .cloud_diagnostics import CloudDiagnostics
 
@@ -13,8 +15,8 @@ class Diagnose():
 
     :fields_sim1: numpy array
 
-        Scalar/vector fields of the first simulation file
-        for initial conditions
+        Density and tracer fields (rho, tr1) of the first
+        simulation file for initial conditions
 
     :shape: tuple
 
@@ -24,10 +26,36 @@ class Diagnose():
 
         x, y, z physical limits of the computational box
 
+    :block: int, optional
+
+        Number of z-planes per slab of the diagnostics pass
+
+    :dtype: string, optional
+
+        float64 (default) or float32 accumulation of the diagnostics
+
+    :planes: list, optional
+
+        (axis, index) pairs of the cuts (default: the z mid-plane)
+
+    :quantities: list, optional
+
+        Quantities to cut (default: n, v), see CloudCuts
+
+    :outdir: string, optional
+
+        Directory of the profiles and text cuts (default: ./clouds/)
+
     """
 
-    def __init__(self, fields_sim1, shape, box):
-        self.shape
+    def __init__(self, fields_sim1, shape, box, block=None, dtype='float64', planes=None, quantities=None, outdir='./clouds/'):
+        self.shape  = shape
+        self.outdir = outdir
+        self.block  = block
+        self.dtype  = dtype
+
+        self.planes     = planes
+        self.quantities = quantities
         box_x, box_y, box_z = box
 
         x = np.linspace(box_x[0], box_x[1], shape[0])
@@ -38,12 +66,17 @@ class Diagnose():
 
         self.j3D = [x.reshape(-1, 1, 1), y.reshape(1, -1, 1), z.reshape(1, 1, -1)]
 
-        dx = np.max(x) - np.min(x) / shape[0]
+        dx = (np.max(x) - np.min(x)) / shape[0]
         self.dV = dx**3
 
-        rho, tr1, _, _, _, _ = fields_sim1
+        rho, tr1 = fields_sim1[:2]
+
+        nk = max(1, 2**20 // (shape[0] * shape[1]))
+        M0 = 0.0
+        for k0 in range(0, shape[2], nk):
+            M0 += float(np.sum(np.multiply(rho[:, :, k0:k0 + nk], tr1[:, :, k0:k0 + nk], dtype=np.float64)))
 
-        self.M0 = np.sum(rho * tr1) * divmod
+        self.M0 = M0 * self.dV
 
     def get_sim_diagnostics(self, fields):
         """
@@ -62,13 +95,59 @@ class Diagnose():
             velocity dispersion
         
         """
-        diagnostics = CloudDiagnostics(self.j3D, self.dV, self.M0)
-        return diagnostics.diagnose(fields)
+        diagnostics = CloudDiagnostics(self.j3D, self.dV, self.M0, self.block, self.dtype)
+        result = diagnostics.diagnose(fields)
+
+        self.profiles = diagnostics.profiles
+
+        return result
+
+    def stream_sim_diagnostics(self, simfile, slab):
+        """
+
+        Get diagnostics of cloud gas from a VTK simulation file
+        read in z-slabs, for snapshots that do not fit in memory
+
+        :simfile: string
+
+            Path to the simulation file
+
+        :slab: int
+
+            Number of z-planes per slab
+
+        :return: numpy arrays
+
+            n_av, T_av, fmix, y_cm, j_sg, v_sg (see get_sim_diagnostics)
+
+        """
+        diagnostics = CloudDiagnostics(self.j3D, self.dV, self.M0, self.block, self.dtype)
+        result = diagnostics.diagnose_slabs(VTKFile(simfile).slabs(VAR_NAMES, slab))
+
+        self.profiles = diagnostics.profiles
+
+        return result
+
+    def get_profiles(self, sinnum):
+        """
+
+        Save the cloud mass marginal profiles along x, y and z of the
+        last diagnosed simulation file
+
+        :sinnum: string
+
+            Number of the simulation to label output files
 
-    def get_cuts(self, fields, sinnum):
         """
+        os.makedirs(self.outdir, exist_ok=True)
 
-        Get cuts for number density and velocity
+        np.savez(self.outdir + 'mprof_' + sinnum + '.npz', **self.profiles)
+
+    def get_cuts(self, fields, sinnum, store=None):
+        """
+
+        Get cuts (by default, number density and velocity
+        at the z mid-plane)
 
         :fields: numpy array
 
@@ -78,7 +157,23 @@ class Diagnose():
 
             Number of the simulation to label output files
 
+        :store: CutStore, optional
+
+            Append the cuts to a binary store instead of writing
+            one text file per cut
+
+        """
+        cuts = CloudCuts(fields, self.shape, sinnum, self.planes, self.quantities, self.outdir)
+
+        if store is None:
+            cuts.get_textcuts()
+        else:
+            store.add(sinnum, cuts.get_planes())
+
+    def get_cut_planes(self, fields, sinnum):
+        """
+
+        Get cuts as arrays (see CloudCuts.get_planes)
+
         """
-        cuts = CloudCuts(fields, sinnum, self.shape)
-        cuts.get_ncuts()
-        cuts.get_vcuts()
\ No newline at end of file
+        return CloudCuts(fields, self.shape, sinnum, self.planes, self.quantities, self.outdir).get_planes()
\ No newline at end of file
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+class CloudMoments():
+    """
+
+    Accumulate the mass-weighted moments of the cloud diagnostics
+    in a single blocked pass over z-slabs of the grid
+
+    Every slab is converted once into reused scratch buffers, and all the
+    sums (cloud mass, first and second moments of n, T, vx, vy, vz and
+    the mixed mass) are reduced from them, so no full-grid temporaries
+    are allocated. The cloud mass is also reduced to its x, y and z
+    marginal profiles, from which the centre of mass and the spatial
+    dispersions are obtained in O(N)
+
+    :j3D: numpy array
+
+        3D reshaped axes for x, y, z
+
+    :dtype: string, optional
+
+        float64 (default) or float32 scratch buffers and slab reductions,
+        the totals are always accumulated in float64
+
+    """
+
+    mu = 0.6724418
+    mm = 1.660e-24
+    kb = 1.380e-16
+
+    names = ['M', 'n', 'T', 'vx', 'vx2', 'vy', 'vy2', 'vz', 'vz2', 'mix']
+
+    def __init__(self, j3D, dtype='float64'):
+        self.j     = [np.ravel(j) for j in j3D]
+        self.dtype = np.dtype(dtype)
+        self.sums  = dict.fromkeys(self.names, 0.0)
+        self.marg  = [np.zeros(len(j)) for j in self.j]
+
+        self._shape   = None
+        self._scratch = None
+
+    def _buffers(self, shape):
+        if shape != self._shape:
+            self._shape   = shape
+            self._scratch = {
+                'in': np.empty(shape, dtype=self.dtype, order='F'),
+                'w': np.empty(shape, dtype=self.dtype, order='F'),
+                'tmp': np.empty(shape, dtype=self.dtype, order='F'),
+                'lo': np.empty(shape, dtype=bool, order='F'),
+                'hi': np.empty(shape, dtype=bool, order='F')
+            }
+
+        return self._scratch
+
+    def add(self, fields, k0=0):
+        """
+
+        Add the contribution of a z-slab
+
+        :fields: list of numpy arrays
+
+            rho, tr1, prs, vx, vy, vz on the slab
+
+        :k0: int
+
+            Index of the first z-plane of the slab
+
+        """
+        rho, tr1, prs, vx, vy, vz = fields
+        buf = self._buffers(rho.shape)
+        sums = self.sums
+
+        inp = buf['in']
+        w   = buf['w']
+        tmp = buf['tmp']
+
+        def flat(a):
+            return a.reshape(-1, order='F')
+
+        np.copyto(inp, rho, casting='unsafe')
+        np.copyto(w, tr1, casting='unsafe')
+        np.greater_equal(w, 0.01, out=buf['lo'])
+        np.less_equal(w, 0.99, out=buf['hi'])
+        np.logical_and(buf['lo'], buf['hi'], out=buf['lo'])
+
+        np.copyto(tmp, prs, casting='unsafe')
+        sums['T'] += float(np.dot(flat(w), flat(tmp)))
+
+        np.multiply(inp, w, out=w)
+        sums['M']   += float(w.sum())
+        sums['n']   += float(np.dot(flat(w), flat(w)))
+        sums['mix'] += float(w.sum(where=buf['lo']))
+
+        wz = w.sum(axis=(0, 1), dtype=np.float64)
+        self.marg[2][k0:k0 + len(wz)] += wz
+        self.marg[1] += w.sum(axis=(0, 2), dtype=np.float64)
+        self.marg[0] += w.sum(axis=(1, 2), dtype=np.float64)
+
+        for name, v in zip(['vx', 'vy', 'vz'], [vx, vy, vz]):
+            np.copyto(inp, v, casting='unsafe')
+            np.multiply(w, inp, out=tmp)
+            sums[name] += float(tmp.sum())
+            sums[name + '2'] += float(np.dot(flat(tmp), flat(inp)))
+
+    def profiles(self, dV):
+        """
+
+        Cloud mass marginal profiles along x, y and z
+
+        :dV: float, volume element of the computational box
+
+        :return: dict with the axes (x, y, z) and the cloud mass
+                 per plane along them (mx, my, mz)
+
+        """
+        return {
+            'x': self.j[0], 'y': self.j[1], 'z': self.j[2],
+            'mx': self.marg[0] * dV, 'my': self.marg[1] * dV, 'mz': self.marg[2] * dV
+        }
+
+    def result(self, dV, M0):
+        """
+
+        Diagnostics from the accumulated moments
+
+        :dV: float, volume element of the computational box
+
+        :M0: float, initial mass of the cloud
+
+        :return: n_av, T_av, fmix, y_cm, j_sg, v_sg
+
+        """
+        sums = self.sums
+        M = sums['M']
+
+        def mwav(name):
+            return np.float64(sums[name]) / M if M != 0 else np.float64(np.nan)
+
+        for name, j, m in zip(['x', 'y', 'z'], self.j, self.marg):
+            jm = j * m
+            sums[name] = jm.sum()
+            sums[name + '2'] = np.dot(jm, j)
+
+        def sigma(name):
+            s  = mwav(name)
+            s2 = mwav(name + '2')
+
+            if np.isnan(s):
+                sg = np.sqrt(s2)
+            else:
+                sg = np.sqrt(max(s2 - s**2, 0))
+
+            return sg
+
+        n_av = mwav('n') / (self.mm * self.mu)
+        T_av = mwav('T') * self.mm * self.mu / self.kb
+        y_cm = mwav('y')
+        fmix = np.float64(sums['mix']) * dV / M0
+
+        j_sg = [sigma(name) * np.sqrt(5) for name in ['x', 'y', 'z']]
+        v_sg = [sigma(name) for name in ['vx', 'vy', 'vz']]
+
+        return n_av, T_av, fmix, y_cm, j_sg, v_sg
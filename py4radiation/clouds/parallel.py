@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ..simload import set_cache, VAR_NAMES
+from ..vtkfile import VTKFile
+from ..snapshots import SnapshotPrefetcher, readsim
+from ..profiling import PROFILER
+
+_diagnostics = None
+
+def _init_worker(diagnostics, cache, profile):
+    """
+
+    Keep the Diagnose instance (coordinates, dV, M0), or the Diagnose
+    instances of a batch by simulation name, the cache and profiling
+    settings in the worker, so they are sent once per worker instead
+    of once per snapshot
+
+    """
+    global _diagnostics
+    _diagnostics = diagnostics
+
+    PROFILER.enabled = profile
+
+    if cache is not None:
+        set_cache(cache.path, cache.maxsize, cache.compression)
+
+def _cuts(diagnostics, fields, sinnum, binary):
+    """
+
+    Write the cuts as text files, or return them for a CutStore
+
+    """
+    if binary:
+        return diagnostics.get_cut_planes(fields, sinnum)
+
+    diagnostics.get_cuts(fields, sinnum)
+
+def _stream(diagnostics, simfile, sinnum, slab, binary):
+    """
+
+    Diagnose a simulation file in z-slabs and take its cuts
+    from memory-mapped fields
+
+    """
+    result = diagnostics.stream_sim_diagnostics(simfile, slab)
+    diagnostics.get_profiles(sinnum)
+
+    vtkfile = VTKFile(simfile)
+    planes  = _cuts(diagnostics, [vtkfile.field(name) for name in VAR_NAMES], sinnum, binary)
+
+    return result, planes
+
+def diagnose_snapshot(diagnostics, simfile, sinnum, slab=None, binary=False):
+    """
+
+    Diagnose, profile and cut a single simulation file
+
+    :return: (n_av, T_av, fmix, y_cm, j_sg, v_sg), cut planes for a
+             CutStore (binary) or None (text cuts written)
+
+    """
+    if slab is not None:
+        return _stream(diagnostics, simfile, sinnum, slab, binary)
+
+    fields, _ = readsim(simfile)
+    result = diagnostics.get_sim_diagnostics(fields)
+    diagnostics.get_profiles(sinnum)
+
+    return result, _cuts(diagnostics, fields, sinnum, binary)
+
+def _diagnose(simfile, sinnum, slab, binary):
+    PROFILER.snapshot = sinnum
+
+    result, planes = diagnose_snapshot(_diagnostics, simfile, sinnum, slab, binary)
+
+    return result, planes, PROFILER.drain()
+
+def _diagnose_batch(name, simfile, sinnum, slab, binary):
+    PROFILER.snapshot = name + ':' + sinnum
+
+    result, planes = diagnose_snapshot(_diagnostics[name], simfile, sinnum, slab, binary)
+
+    return result, planes, PROFILER.drain()
+
+def diagnose_snapshots(diagnostics, simfiles, sinnums, workers=1, cache=None, prefetch=2, prefetch_mem=None, slab=None, cutstore=None):
+    """
+
+    Diagnose, profile and cut a list of simulation files
+
+    With a single worker the snapshots are diagnosed in this process
+    while the next ones are prefetched; otherwise they are spread over a
+    pool of worker processes. Results are always yielded, and cuts
+    appended to a CutStore, in snapshot order
+
+    **Parameters**
+
+    :diagnostics: Diagnose instance
+
+    :simfiles: list of strings, paths to the simulation files
+
+    :sinnums: list of strings, numbers of the simulations to label output files
+
+    :workers: int, optional, number of worker processes
+
+    :cache: SnapshotCache, optional, cache used by simload in the workers
+
+    :prefetch: int, optional, read-ahead depth with a single worker
+
+    :prefetch_mem: string or int, optional, memory ceiling of the read-ahead
+
+    :slab: int, optional
+
+        Stream every snapshot in z-slabs of this many planes
+        instead of loading it whole (out-of-core mode)
+
+    :cutstore: CutStore, optional
+
+        Binary store for the cuts (default: one text file per cut)
+
+    :return: generator of (n_av, T_av, fmix, y_cm, j_sg, v_sg)
+
+    """
+    binary = cutstore is not None
+
+    def pooled():
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(diagnostics, cache, PROFILER.enabled)) as pool:
+            n = len(simfiles)
+            for result, planes, events in pool.map(_diagnose, simfiles, sinnums, [slab] * n, [binary] * n):
+                PROFILER.events.extend(events)
+                yield result, planes
+
+    def streamed():
+        for simfile, sinnum in zip(simfiles, sinnums):
+            PROFILER.snapshot = sinnum
+            yield _stream(diagnostics, simfile, sinnum, slab, binary)
+
+    def serial():
+        snapshots = SnapshotPrefetcher(simfiles, depth=prefetch, maxmem=prefetch_mem)
+
+        for sinnum, (fields, _) in zip(sinnums, snapshots):
+            PROFILER.snapshot = sinnum
+            result = diagnostics.get_sim_diagnostics(fields)
+            diagnostics.get_profiles(sinnum)
+
+            yield result, _cuts(diagnostics, fields, sinnum, binary)
+
+    if workers > 1:
+        results = pooled()
+    elif slab is not None:
+        results = streamed()
+    else:
+        results = serial()
+
+    for sinnum, (result, planes) in zip(sinnums, results):
+        if binary:
+            cutstore.add(sinnum, planes)
+
+        yield result
+
+def diagnose_batch(simulations, workers=1, cache=None, slab=None):
+    """
+
+    Diagnose, profile and cut the snapshots of several simulations
+    over one shared pool of worker processes
+
+    The snapshots of all the simulations are queued together, largest
+    file first, so that the pool stays busy until the whole study is
+    done instead of draining at the end of every simulation. The
+    Diagnose instances are sent once per worker. Results are yielded as
+    soon as all the earlier snapshots of the same simulation are done,
+    so the outputs of every simulation are written in snapshot order
+
+    **Parameters**
+
+    :simulations: dict
+
+        Name of every simulation mapped to (Diagnose instance,
+        simulation files, snapshot numbers, CutStore or None)
+
+    :workers: int, optional, number of worker processes
+
+    :cache: SnapshotCache, optional, cache used by simload in the workers
+
+    :slab: int, optional, stream every snapshot in z-slabs of this many planes
+
+    :return: generator of (name, snapshot number, (n_av, T_av, fmix, y_cm, j_sg, v_sg))
+
+    """
+    tasks = []
+    for name, (diagnostics, simfiles, sinnums, cutstore) in simulations.items():
+        for k, (simfile, sinnum) in enumerate(zip(simfiles, sinnums)):
+            tasks.append((os.path.getsize(simfile), name, k, simfile, sinnum))
+
+    tasks.sort(key=lambda task: -task[0])
+
+    done = {name: {} for name in simulations}
+    nxt  = dict.fromkeys(simulations, 0)
+
+    def completed():
+        if workers > 1:
+            diagnostics = {name: sim[0] for name, sim in simulations.items()}
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(diagnostics, cache, PROFILER.enabled)) as pool:
+                futures = {}
+                for _, name, k, simfile, sinnum in tasks:
+                    binary = simulations[name][3] is not None
+                    futures[pool.submit(_diagnose_batch, name, simfile, sinnum, slab, binary)] = (name, k)
+
+                for future in as_completed(futures):
+                    result, planes, events = future.result()
+                    PROFILER.events.extend(events)
+                    yield futures[future] + (result, planes)
+        else:
+            for _, name, k, simfile, sinnum in tasks:
+                PROFILER.snapshot = name + ':' + sinnum
+                binary = simulations[name][3] is not None
+                yield (name, k) + diagnose_snapshot(simulations[name][0], simfile, sinnum, slab, binary)
+
+    for name, k, result, planes in completed():
+        done[name][k] = (result, planes)
+
+        diagnostics, simfiles, sinnums, cutstore = simulations[name]
+        while nxt[name] in done[name]:
+            result, planes = done[name].pop(nxt[name])
+            sinnum = sinnums[nxt[name]]
+
+            if cutstore is not None:
+                cutstore.add(sinnum, planes)
+
+            nxt[name] += 1
+            yield name, sinnum, result
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+import os
+import numpy as np
+
+COLUMNS = ['n_av', 'T_av', 'fmix', 'y_cm', 'x_sg', 'y_sg', 'z_sg', 'vx_sg', 'vy_sg', 'vz_sg']
+
+EXTENSIONS = {'text': '.dat', 'npz': '.npz', 'hdf5': '.h5', 'parquet': '.parquet'}
+
+class DiagnosticsWriter():
+    """
+
+    Write the diagnostics of a run one snapshot at a time
+
+    The text and HDF5 backends flush every row to disk as soon as it is
+    written, so the results of a run can be read while it is still
+    going; the columnar backends write complete tables as the run goes
+    (see ColumnWriter) and when they are closed. Backends
+    define write(sinnum, row), with the number of the simulation and
+    the diagnostics of the snapshot in the order of COLUMNS
+
+    :path: string
+
+        Path to the output file
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def close(self):
+        None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class TextWriter(DiagnosticsWriter):
+    """
+
+    Plain-text diagnostics (one row per snapshot, 10 columns, .7E format)
+
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.file = open(path, 'w')
+
+    def write(self, sinnum, row):
+        np.savetxt(self.file, np.asarray(row, dtype=np.float64).reshape(1, -1), fmt='%.7E', delimiter='  ')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class ColumnWriter(DiagnosticsWriter):
+    """
+
+    Base of the columnar writers, which keep the rows in memory and
+    write the whole table atomically, so that the file is always
+    complete. The table is written when the number of rows reaches a
+    power of two and when the writer is closed, so a run of N snapshots
+    writes O(N) rows in total and the file lags the run by at most half
+    of its rows
+
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.snapshots = []
+        self.rows = []
+        self.written = 0
+
+    def write(self, sinnum, row):
+        self.snapshots.append(int(sinnum))
+        self.rows.append([float(r) for r in row])
+
+        n = len(self.rows)
+        if n & (n - 1) == 0:
+            self.flush()
+
+    def flush(self):
+        """
+
+        Write the table with all the rows so far
+
+        """
+        if self.written == len(self.rows):
+            return
+
+        tmp = self.path + '.tmp' + EXTENSIONS[self.backend]
+        self.dump(tmp, self.table())
+        os.replace(tmp, self.path)
+
+        self.written = len(self.rows)
+
+    def close(self):
+        self.flush()
+
+    def table(self):
+        rows = np.array(self.rows, dtype=np.float64).reshape(-1, len(COLUMNS))
+
+        table = {'snapshot': np.array(self.snapshots, dtype=np.int64)}
+        for i, name in enumerate(COLUMNS):
+            table[name] = rows[:, i]
+
+        return table
+
+class NPZWriter(ColumnWriter):
+    """
+
+    Diagnostics as a NumPy .npz archive with one array per column
+
+    """
+
+    backend = 'npz'
+
+    def dump(self, path, table):
+        np.savez(path, **table)
+
+class HDF5Writer(DiagnosticsWriter):
+    """
+
+    Diagnostics as an HDF5 file with one resizable dataset per column,
+    opened in SWMR mode so that readers can follow a running analysis
+    (requires h5py)
+
+    """
+
+    backend = 'hdf5'
+
+    def __init__(self, path):
+        super().__init__(path)
+
+        import h5py
+
+        self.file = h5py.File(path, 'w', libver='latest')
+        self.file.create_dataset('snapshot', (0,), maxshape=(None,), dtype='i8')
+        for name in COLUMNS:
+            self.file.create_dataset(name, (0,), maxshape=(None,), dtype='f8')
+        self.file.swmr_mode = True
+
+    def write(self, sinnum, row):
+        for name, value in zip(['snapshot'] + COLUMNS, [int(sinnum)] + list(row)):
+            dset = self.file[name]
+            dset.resize((dset.shape[0] + 1,))
+            dset[-1] = value
+            dset.flush()
+
+    def close(self):
+        self.file.close()
+
+class ParquetWriter(ColumnWriter):
+    """
+
+    Diagnostics as an Apache Parquet table (requires pyarrow)
+
+    """
+
+    backend = 'parquet'
+
+    def dump(self, path, table):
+        import pyarrow
+        import pyarrow.parquet
+
+        pyarrow.parquet.write_table(pyarrow.table(table), path)
+
+WRITERS = {'text': TextWriter, 'npz': NPZWriter, 'hdf5': HDF5Writer, 'parquet': ParquetWriter}
+
+def diagnostics_writer(prefix, backend='text'):
+    """
+
+    Open a diagnostics writer
+
+    **Parameters**
+
+    :prefix: string, path to the output file without extension
+
+    :backend: string, text (default), npz, hdf5 or parquet
+
+    :return: DiagnosticsWriter
+
+    """
+    if backend not in WRITERS:
+        raise Exception('Diagnostics backends: text, npz, hdf5, parquet')
+
+    return WRITERS[backend](prefix + EXTENSIONS[backend])
+
+def read_diagnostics(path):
+    """
+
+    Read a diagnostics file of any backend in a single call
+
+    :path: string, path to the output file
+
+    :return: dict of numpy arrays, one per column
+
+    """
+    ext = os.path.splitext(path)[1]
+
+    if ext == '.npz':
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+
+    if ext == '.h5':
+        import h5py
+        with h5py.File(path, 'r', libver='latest', swmr=True) as data:
+            return {name: data[name][()] for name in data}
+
+    if ext == '.parquet':
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(path)
+        return {name: table[name].to_numpy() for name in table.column_names}
+
+    rows = np.loadtxt(path, ndmin=2)
+    return {name: rows[:, i] for i, name in enumerate(COLUMNS)}
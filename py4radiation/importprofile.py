@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import importlib
+
+def process_age():
+    """
+
+    Seconds since the process started (Linux, from /proc, with the
+    resolution of the clock ticks), None where it is not available
+
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return max(0.0, uptime - ticks / os.sysconf('SC_CLK_TCK'))
+
+class ImportProfile():
+    """
+
+    Import subsystems on first use and record how long each import took
+    and which third-party packages it pulled in
+
+    The startup is split into the interpreter (from the start of the
+    process to the import of the package), the package (py4radiation
+    and its base imports) and the CLI module
+
+    :start: float, optional
+
+        perf_counter time at which the CLI module started to import
+
+    :package_start: float, optional
+
+        perf_counter time at which the package started to import
+
+    """
+
+    def __init__(self, start=None, package_start=None):
+        self.records = []
+
+        now = time.perf_counter()
+        age = process_age()
+
+        if package_start is not None:
+            if age is not None:
+                self.records.append(('python', max(0.0, age - (now - package_start)), []))
+            if start is not None:
+                self.records.append(('py4radiation', start - package_start, []))
+
+        if start is not None:
+            self.records.append(('py4radiation.main', now - start, []))
+
+    def load(self, name, package=None):
+        """
+
+        Import a module and record the time it took
+
+        :name: string, module name (relative names need package)
+
+        :package: string, optional, anchor of relative module names
+
+        :return: module
+
+        """
+        before = set(sys.modules)
+        t0 = time.perf_counter()
+
+        module = importlib.import_module(name, package)
+
+        elapsed = time.perf_counter() - t0
+        stdlib = getattr(sys, 'stdlib_module_names', set())
+        new = sorted({m.split('.')[0] for m in set(sys.modules) - before}
+                     - stdlib - {'py4radiation', '__mp_main__'})
+
+        self.records.append((module.__name__, elapsed, new))
+
+        return module
+
+    def report(self):
+        """
+
+        Print where the import time went
+
+        """
+        print('Import profile')
+        for name, elapsed, new in self.records:
+            line = f'  {elapsed:8.3f} s  {name}'
+            if new:
+                line += '  (' + ', '.join(new) + ')'
+            print(line)
+
+        total = sum(record[1] for record in self.records)
+        print(f'  {total:8.3f} s  total')
@@ -1,18 +1,292 @@
 #!/usr/bin/env python3
 
+import time
+_start = time.perf_counter()
+
 import os
 import sys
+import glob
+import json
+import shutil
 import argparse
 from configparser import ConfigParser
 
 import numpy as np
-import pandas as pd
 
-from .simload import simload
-from radiation.prepare_sed import SED
-from radiation.parfiles import ParameterFiles
-from synthetic.observables import SyntheticObservables
-from clouds.diagnose import Diagnose
+from .cache import parse_size
+from .simload import simload, set_cache
+from .snapshots import find_snapshots, SnapshotWatcher
+from .manifest import Manifest
+from .importprofile import ImportProfile
+from .profiling import PROFILER
+
+def clouds_simfiles(conf, simpath=None):
+    """
+
+    Simulation files of the CLOUDS mode
+
+    :conf: ConfigParser
+
+    :simpath: string, optional, simulation directory (default: simpath of the CLOUDS section)
+
+    :return: snapshot numbers, simulation files
+
+    """
+    clouds = conf['CLOUDS']
+
+    return find_snapshots(simpath if simpath is not None else clouds['simpath'],
+                          clouds.get('snapshots', 'data.*.dat'),
+                          clouds.getint('first'),
+                          clouds.getint('last'),
+                          clouds.getint('stride', 1))
+
+def clouds_diagnose(conf, simpath, Diagnose, outdir='./clouds/'):
+    """
+
+    Diagnose instance of a simulation of the CLOUDS mode, with the
+    initial conditions read from its first snapshot
+
+    :conf: ConfigParser
+
+    :simpath: string, simulation directory
+
+    :Diagnose: Diagnose class
+
+    :outdir: string, optional, directory of the profiles and text cuts,
+             created here so that pool workers never race to create it
+
+    """
+    os.makedirs(outdir, exist_ok=True)
+
+    box_x   = np.array(conf['CLOUDS']['box_x'].split()).astype(int)
+    box_y   = np.array(conf['CLOUDS']['box_y'].split()).astype(int)
+    box_z   = np.array(conf['CLOUDS']['box_z'].split()).astype(int)
+
+    box = [box_x, box_y, box_z]
+
+    fields_sim1, shape = simload(simpath + 'data.0000.vtk', ['rho', 'tr1'])
+    if 'cut_planes' in conf['CLOUDS']:
+        planes = [plane.split(':') for plane in conf['CLOUDS']['cut_planes'].split()]
+    else:
+        planes = None
+
+    if 'cut_quantities' in conf['CLOUDS']:
+        quantities = conf['CLOUDS']['cut_quantities'].split()
+    else:
+        quantities = None
+
+    return Diagnose(fields_sim1, shape, box,
+                    block=conf['CLOUDS'].getint('block'),
+                    dtype=conf['CLOUDS'].get('precision', 'float64'),
+                    planes=planes,
+                    quantities=quantities,
+                    outdir=outdir)
+
+def clouds_simulations(conf):
+    """
+
+    Simulations of the CLOUDS mode: the one given by simpath and simname,
+    or every directory matching the simpaths option (parameter studies),
+    named after the directory
+
+    :conf: ConfigParser
+
+    :return: list of (name, simulation directory, directory of the profiles and text cuts)
+
+    """
+    if 'simpaths' not in conf['CLOUDS']:
+        return [(conf['CLOUDS']['simname'], conf['CLOUDS']['simpath'], './clouds/')]
+
+    simpaths = []
+    for pattern in conf['CLOUDS']['simpaths'].split():
+        simpaths += sorted(path for path in glob.glob(pattern) if os.path.isdir(path))
+
+    simulations = []
+    for simpath in simpaths:
+        simpath  = os.path.join(simpath, '')
+        sim_name = os.path.basename(os.path.dirname(simpath))
+        if sim_name in [sim[0] for sim in simulations]:
+            raise Exception('Simulation directories must have different names: ' + simpath)
+
+        simulations.append((sim_name, simpath, './clouds/' + sim_name + '/'))
+
+    return simulations
+
+def clouds_outputs(conf, sim_name, CutStore):
+    """
+
+    Manifest and cut store of a simulation of the CLOUDS mode
+
+    :conf: ConfigParser
+
+    :sim_name: string, name of the simulation
+
+    :CutStore: CutStore class
+
+    :return: Manifest, CutStore (None for text cuts)
+
+    """
+    settings = {key: conf['CLOUDS'][key] for key in
+                ['box_x', 'box_y', 'box_z', 'precision', 'cut_planes', 'cut_quantities', 'cuts']
+                if key in conf['CLOUDS']}
+    manifest = Manifest('./clouds/' + sim_name + '_manifest.json', settings)
+
+    if conf['CLOUDS'].get('cuts', 'binary') == 'binary':
+        cutpath = './clouds/' + sim_name + '_cuts/'
+        if len(manifest) == 0:
+            shutil.rmtree(cutpath, ignore_errors=True)
+        cutstore = CutStore(cutpath, conf['CLOUDS'].get('cuts_compression'))
+    else:
+        cutstore = None
+
+    return manifest, cutstore
+
+def synthetic_setup(conf, imports):
+    """
+
+    Ions, units and ion table of the SYNTHETIC mode
+
+    :conf: ConfigParser
+
+    :imports: ImportProfile
+
+    :return: ions, units, IonTable (or None)
+
+    """
+    pd = imports.load('pandas')
+
+    ions    = pd.read_csv(conf['SYNTHETIC']['ionsfile'], sep=r'\s+', header=None).to_numpy()
+    units   = pd.read_csv(conf['SYNTHETIC']['unitsfile'], sep=r'\s+', header=None).to_numpy()[1]
+
+    if 'ionfractions' in conf['SYNTHETIC']:
+        IonTable  = imports.load('.synthetic.ion_table', __package__).IonTable
+        ion_table = IonTable(conf['SYNTHETIC']['ionfractions'],
+                             conf['SYNTHETIC'].getfloat('redshift', 0.0),
+                             sorted(set(ions[:, 0])))
+    else:
+        ion_table = None
+
+    return ions, units, ion_table
+
+def synthetic_simfiles(conf):
+    """
+
+    Simulation files of the SYNTHETIC mode: the snapshots matching the
+    snapshots option, or the single simfile
+
+    :conf: ConfigParser
+
+    :return: snapshot numbers (None for a single simfile), simulation files
+
+    """
+    simpath = conf['SYNTHETIC']['simpath']
+
+    if 'snapshots' in conf['SYNTHETIC']:
+        return find_snapshots(simpath,
+                              conf['SYNTHETIC']['snapshots'],
+                              conf['SYNTHETIC'].getint('first'),
+                              conf['SYNTHETIC'].getint('last'),
+                              conf['SYNTHETIC'].getint('stride', 1))
+
+    return [None], [simpath + conf['SYNTHETIC']['simfile']]
+
+def synthetic_sightlines(conf, shape, imports):
+    """
+
+    Sightline grid of the SYNTHETIC mode, None for the default rays
+
+    :conf: ConfigParser
+
+    :shape: tuple, dimensions of the computational box
+
+    :imports: ImportProfile
+
+    """
+    if 'sightlines' not in conf['SYNTHETIC']:
+        return None
+
+    sightline_grid = imports.load('.synthetic.sightlines', __package__).sightline_grid
+
+    return sightline_grid(shape,
+                          conf['SYNTHETIC']['sightlines'],
+                          step=conf['SYNTHETIC'].getint('sightlines_step', 1),
+                          n=conf['SYNTHETIC'].getint('sightlines_n'),
+                          seed=conf['SYNTHETIC'].getint('sightlines_seed', 0),
+                          filename=conf['SYNTHETIC'].get('sightlines_file'))
+
+def synthetic_outdir(sinnum):
+    """
+
+    Output directory of a snapshot of the SYNTHETIC mode
+
+    """
+    if sinnum is None:
+        return './observables/'
+
+    return './observables/' + sinnum + '/'
+
+def synthetic_observables(conf, observables, simfile, sinnum, setup, imports):
+    """
+
+    SyntheticObservables of a snapshot: set up on the first snapshot,
+    with the fields of the later ones swapped into its dataset
+
+    :conf: ConfigParser
+
+    :observables: SyntheticObservables or None (first snapshot)
+
+    :simfile: string, simulation file
+
+    :sinnum: string or None, snapshot number
+
+    :setup: ions, units and ion table, see synthetic_setup
+
+    :imports: ImportProfile
+
+    """
+    ions, units, ion_table = setup
+
+    fields, shape = simload(simfile)
+    obs = synthetic_outdir(sinnum)
+
+    if observables is None:
+        SyntheticObservables = imports.load('.synthetic.observables', __package__).SyntheticObservables
+        observables = SyntheticObservables(fields, shape, ions, units, ion_table,
+                                           lean=conf['SYNTHETIC'].getboolean('lean', False),
+                                           precision=conf['SYNTHETIC'].get('precision', 'float64'),
+                                           nprocs=conf['SYNTHETIC'].getint('nprocs', 1))
+
+        if os.path.isdir(obs):
+            None
+        else:
+            os.mkdir(obs)
+
+        observables.obs = obs
+    else:
+        observables.swap(fields, obs)
+
+    PROFILER.snapshot = sinnum
+
+    return observables
+
+def synthetic_maps(conf, observables):
+    """
+
+    Column density maps and spectral cubes of the current snapshot
+
+    """
+    observables.get_column_densities(conf['SYNTHETIC'].get('column_engine', 'native'),
+                                     conf['SYNTHETIC'].get('columns', 'binary'),
+                                     conf['SYNTHETIC'].get('columns_compression'),
+                                     tuple(np.array(conf['SYNTHETIC'].get('columns_levels', '1 2 4 8').split()).astype(int)),
+                                     conf['SYNTHETIC'].get('columns_precision', 'float64'))
+
+    if 'spectral_cube' in conf['SYNTHETIC']:
+        observables.get_spectral_cube(conf['SYNTHETIC']['spectral_cube'],
+                                      conf['SYNTHETIC'].getfloat('cube_vmin', -500),
+                                      conf['SYNTHETIC'].getfloat('cube_vmax', 0),
+                                      conf['SYNTHETIC'].getfloat('cube_dv', 1),
+                                      parse_size(conf['SYNTHETIC'].get('cube_memory', '256M')))
 
 def main():
     parser = argparse.ArgumentParser(
@@ -20,17 +294,86 @@ def main():
         description = 'UV radiation effects into HD/MHD wind-cloud simulations'
     )
 
-    parser.add_argument('-f', type='str', required=True, help='CONFIG file')
+    parser.add_argument('-f', type=str, required=True, help='CONFIG file')
+    parser.add_argument('--workers', type=int, help='number of worker processes for CLOUDS mode and sightline spectra')
+    parser.add_argument('--import-profile', action='store_true', help='report where the import time goes')
+    parser.add_argument('--profile', metavar='PREFIX', help='record per-stage profiles to PREFIX.json and PREFIX.trace.json')
+    parser.add_argument('--cache', choices=['warm', 'prune'], help='warm or prune the snapshot cache and exit')
+    parser.add_argument('--follow', action='store_true', help='keep diagnosing new snapshots while the simulation runs')
+    parser.add_argument('--queue', choices=['submit', 'work', 'reduce', 'status'],
+                        help='submit tasks to, work on, reduce or show the status of the QUEUE work queue')
 
     file = parser.parse_args()
     conf = ConfigParser()
     conf.read(file.f)
 
+    imports = ImportProfile(_start, sys.modules[__package__]._start)
+
+    if file.profile is not None:
+        profile = file.profile
+    elif conf.has_section('PROFILE'):
+        profile = conf['PROFILE'].get('output', 'py4radiation_profile')
+    else:
+        profile = None
+
+    PROFILER.enabled = profile is not None
+
+    try:
+        run(file, conf, imports)
+    finally:
+        if file.import_profile:
+            imports.report()
+
+        if profile is not None:
+            PROFILER.to_json(profile + '.json')
+            PROFILER.to_chrome_trace(profile + '.trace.json')
+
+def run(file, conf, imports):
+    """
+
+    Run the mode selected in the CONFIG file
+
+    :file: argparse Namespace, command line arguments
+
+    :conf: ConfigParser, CONFIG file
+
+    :imports: ImportProfile, used to import the subsystems on first use
+
+    """
+
+    if conf.has_section('CACHE'):
+        cache = set_cache(conf['CACHE']['path'],
+                          conf['CACHE'].get('maxsize'),
+                          conf['CACHE'].get('compression'))
+    else:
+        cache = None
+
+    if file.cache is not None:
+        if cache is None:
+            raise Exception('Set the CACHE section (path, maxsize, compression) in the CONFIG file')
+
+        if file.cache == 'warm':
+            simfiles = []
+            if conf.has_section('SYNTHETIC'):
+                simfiles += synthetic_simfiles(conf)[1]
+            if conf.has_section('CLOUDS'):
+                simfiles.append(conf['CLOUDS']['simpath'] + 'data.0000.vtk')
+                simfiles += clouds_simfiles(conf)[1]
+
+            cache.warm(simfiles)
+        else:
+            evicted = cache.prune()
+            print(f'{len(evicted)} snapshots evicted from the cache')
+
+        return
+
     mode = int(conf['MODE']['mode'])
 
     if mode == 0:
         print('PHOTOIONISATION + RADIATIVE HEATING & COOLING mode')
 
+        ParameterFiles = imports.load('.radiation.parfiles', __package__).ParameterFiles
+
         redshift = conf['RADIATION']['redshift']
 
         if conf['RADIATION']['sedfile'] != None:
@@ -38,6 +381,7 @@ def main():
             distance = conf['RADIATION']['distance']
             age      = conf['RADIATION']['age']
 
+            SED = imports.load('.radiation.prepare_sed', __package__).SED
             sed = SED(sedfile, distance, redshift, age)
             sed.getFile()
 
@@ -58,87 +402,471 @@ def main():
         else:
             os.mkdir('./observables/')
 
-        simpath = conf['SYNTHETIC']['simpath']
-        simfile = simpath + conf['SYNTHETIC']['simfile']
-        ions    = pd.read_csv(conf['SYNTHETIC']['ionsfile'], sep=r'\s+', header=None).to_numpy()
-        units   = pd.read_csv(conf['SYNTHETIC']['unitsfile'], sep=r'\s+', header=None).to_numpy()[1]
+        if file.workers is not None:
+            workers = file.workers
+        else:
+            workers = conf['SYNTHETIC'].getint('workers', 1)
+
+        if file.queue is not None:
+            synthetic_queue(file.queue, conf, workers, imports)
+            return
+
+        setup = synthetic_setup(conf, imports)
+        sinnums, simfiles = synthetic_simfiles(conf)
+
+        observables = None
+        sightlines  = None
 
-        fields, shape = simload(simfile)
-        observables = SyntheticObservables(fields, shape, ions, units)
-        observables.get_column_densities()
-        observables.get_mock_spectra()
+        for k, simfile in enumerate(simfiles):
+            if observables is None:
+                observables = synthetic_observables(conf, None, simfile, sinnums[k], setup, imports)
+                sightlines  = synthetic_sightlines(conf, observables.shape, imports)
+            else:
+                synthetic_observables(conf, observables, simfile, sinnums[k], setup, imports)
+
+            synthetic_maps(conf, observables)
+            observables.get_mock_spectra(sightlines, workers, conf['SYNTHETIC'].getint('spectra_batch', 64))
+
+            if sinnums[k] is not None:
+                print(f'Simulation {k + 1} out of {len(simfiles)} done')
 
     elif mode == 2:
         print('CLOUDS mode')
 
+        Diagnose           = imports.load('.clouds.diagnose', __package__).Diagnose
+        diagnose_snapshots = imports.load('.clouds.parallel', __package__).diagnose_snapshots
+        CutStore           = imports.load('.clouds.cut_store', __package__).CutStore
+        diagnostics_writer = imports.load('.clouds.writers', __package__).diagnostics_writer
+
         if os.path.isdir('./clouds/'):
             None
         else:
             os.mkdir('./clouds/')
 
+        if file.workers is not None:
+            workers = file.workers
+        else:
+            workers = conf['CLOUDS'].getint('workers', 1)
+
+        if file.queue is not None:
+            clouds_queue(file.queue, conf, workers, imports)
+            return
+
+        if 'simpaths' in conf['CLOUDS']:
+            clouds_batch(conf, workers, cache, imports)
+            return
+
         simpath  = conf['CLOUDS']['simpath']
         sim_name = conf['CLOUDS']['simname']
-        box_x   = np.array(conf['CLOUDS']['box_x'].split()).astype(int)
-        box_y   = np.array(conf['CLOUDS']['box_y'].split()).astype(int)
-        box_z   = np.array(conf['CLOUDS']['box_z'].split()).astype(int)
-
-        box = [box_x, box_y, box_z]
-
-        fields_sim1, shape = simload(simpath + 'data.0000.vtk')
-        diagnostics = Diagnose(fields_sim1, shape, box)
-        
-        sinnums = []
-        for i in range(81):
-            if i < 10:
-                sinnums.append('000' + str(i))
-            else:
-                sinnums.append('00' + str(i))
-
-        simfiles = []
-        for j in sinnums:
-            simfiles.append(simpath + 'data.' + j + '.dat')
-
-        n_list = []
-        T_list = []
-        fmix_l = []
-        ycm_ls = []
-        xsg_ls = []
-        ysg_ls = []
-        zsg_ls = []
-        vxsgls = []
-        vysgls = []
-        vzsgls = []
-
-        for k in range(81):
-            fields, _ = simload(simfiles[k])
-            n_av, T_av, fmix, y_cm, j_sg, v_sg = diagnostics.get_sim_diagnostics(fields)
-            n_list.append(n_av)
-            T_list.append(T_av)
-            fmix_l.append(fmix)
-            ycm_ls.append(y_cm)
-            xsg_ls.append(j_sg[0])
-            ysg_ls.append(j_sg[1])
-            zsg_ls.append(j_sg[2])
-            vxsgls.append(v_sg[0])
-            vysgls.append(v_sg[1])
-            vzsgls.append(v_sg[2])
-
-            diagnostics.get_cuts(fields, sinnums[k])
-
-            print(f'Simulation {k + 1} out of 81 done')
-
-        nfile = './clouds/' + sim_name + '_diagnostics.dat'
-        stdout = sys.stdout
-        with open(nfile, 'w') as f:
-            sys.stdout = f
-            for m in range(81):
-                print('{0:.7E}'.format(n_list[m]) + '  ' + '{0:.7E}'.format(T_list[m]) + '  ' + '{0:.7E}'.format(fmix_l[m]) + '  ' + '{0:.7E}'.format(ycm_ls[m]) + '  ' + '{0:.7E}'.format(xsg_ls[m]) + '  ' + '{0:.7E}'.format(ysg_ls[m]) + '  ' + '{0:.7E}'.format(zsg_ls[m]) + '  ' + '{0:.7E}'.format(vxsgls[m]) + '  ' + '{0:.7E}'.format(vysgls[m]) + '  ' + '{0:.7E}'.format(vzsgls[m]))
-            
-            sys.stdout = stdout
+
+        diagnostics = clouds_diagnose(conf, simpath, Diagnose)
+
+        sinnums, simfiles = clouds_simfiles(conf)
+
+        if file.follow:
+            watcher = SnapshotWatcher(simpath,
+                                      conf['CLOUDS'].get('snapshots', 'data.*.dat'),
+                                      first=conf['CLOUDS'].getint('first'),
+                                      last=conf['CLOUDS'].getint('last'),
+                                      stride=conf['CLOUDS'].getint('stride', 1),
+                                      poll=conf['CLOUDS'].getfloat('follow_poll', 0.5),
+                                      maxpoll=conf['CLOUDS'].getfloat('follow_maxpoll', 10.0),
+                                      settle=conf['CLOUDS'].getfloat('follow_settle', 0.5),
+                                      timeout=conf['CLOUDS'].getfloat('follow_timeout'))
+
+            # snapshots still being written are left to the watcher
+            ncomplete = 0
+            while ncomplete < len(simfiles) and watcher.complete(simfiles[ncomplete]):
+                ncomplete += 1
+
+            sinnums  = sinnums[:ncomplete]
+            simfiles = simfiles[:ncomplete]
+            watcher.skip(sinnums)
+
+        manifest, cutstore = clouds_outputs(conf, sim_name, CutStore)
+
+        todo = [k for k in range(len(sinnums)) if not manifest.done(sinnums[k], simfiles[k])]
+        print(f'{len(sinnums) - len(todo)} out of {len(sinnums)} simulations already done')
+
+        results = diagnose_snapshots(diagnostics,
+                                     [simfiles[k] for k in todo],
+                                     [sinnums[k] for k in todo],
+                                     workers, cache,
+                                     prefetch=conf['CLOUDS'].getint('prefetch', 2),
+                                     prefetch_mem=conf['CLOUDS'].get('prefetch_mem'),
+                                     slab=conf['CLOUDS'].getint('slab'),
+                                     cutstore=cutstore)
+
+        writer = diagnostics_writer('./clouds/' + sim_name + '_diagnostics',
+                                    conf['CLOUDS'].get('output', 'text'))
+
+        with writer:
+            i = 0
+            for k in range(len(sinnums)):
+                if i < len(todo) and todo[i] == k:
+                    n_av, T_av, fmix, y_cm, j_sg, v_sg = next(results)
+                    manifest.record(sinnums[k], simfiles[k], [n_av, T_av, fmix, y_cm] + list(j_sg) + list(v_sg))
+
+                    i += 1
+                    print(f'Simulation {i} out of {len(todo)} done')
+
+                writer.write(sinnums[k], manifest.result(sinnums[k]))
+
+            if file.follow:
+                print('Following ' + simpath + ' (Ctrl-C to stop)')
+
+                try:
+                    for sinnum, simfile in watcher:
+                        if not manifest.done(sinnum, simfile):
+                            results = diagnose_snapshots(diagnostics, [simfile], [sinnum], 1, cache,
+                                                         prefetch=0,
+                                                         slab=conf['CLOUDS'].getint('slab'),
+                                                         cutstore=cutstore)
+                            n_av, T_av, fmix, y_cm, j_sg, v_sg = next(results)
+                            manifest.record(sinnum, simfile, [n_av, T_av, fmix, y_cm] + list(j_sg) + list(v_sg))
+
+                        writer.write(sinnum, manifest.result(sinnum))
+                        print(f'Simulation {sinnum} done: fmix = {manifest.result(sinnum)[2]:.4E}, '
+                              f'y_cm = {manifest.result(sinnum)[3]:.4E}')
+                except KeyboardInterrupt:
+                    print('Follow mode stopped')
+
         print('DIAGNOSE and CUTS done')
 
     else:
         raise Exception('MODES: (1) radiation (2) synthetic (3) clouds')
     
+def clouds_batch(conf, workers, cache, imports):
+    """
+
+    Run the CLOUDS mode on several simulations at once (parameter
+    studies), with the snapshots of all of them sharing one pool of
+    worker processes
+
+    The simulation directories are given by the simpaths option of the
+    CLOUDS section (directories or glob patterns). Every simulation is
+    named after its directory and keeps its own diagnostics, manifest and
+    cuts in ./clouds/, and its profiles and text cuts in ./clouds/<name>/
+
+    :conf: ConfigParser, CONFIG file
+
+    :workers: int, number of worker processes
+
+    :cache: SnapshotCache, optional
+
+    :imports: ImportProfile
+
+    """
+    Diagnose           = imports.load('.clouds.diagnose', __package__).Diagnose
+    diagnose_batch     = imports.load('.clouds.parallel', __package__).diagnose_batch
+    CutStore           = imports.load('.clouds.cut_store', __package__).CutStore
+    diagnostics_writer = imports.load('.clouds.writers', __package__).diagnostics_writer
+
+    simulations = {}
+    manifests   = {}
+    snapshots   = {}
+    for sim_name, simpath, outdir in clouds_simulations(conf):
+        diagnostics = clouds_diagnose(conf, simpath, Diagnose, outdir)
+        sinnums, simfiles  = clouds_simfiles(conf, simpath)
+        manifest, cutstore = clouds_outputs(conf, sim_name, CutStore)
+
+        todo = [k for k in range(len(sinnums)) if not manifest.done(sinnums[k], simfiles[k])]
+        print(f'{sim_name}: {len(sinnums) - len(todo)} out of {len(sinnums)} simulations already done')
+
+        simulations[sim_name] = (diagnostics, [simfiles[k] for k in todo], [sinnums[k] for k in todo], cutstore)
+        manifests[sim_name]   = manifest
+        snapshots[sim_name]   = (sinnums, simfiles)
+
+    ntodo = sum(len(sim[1]) for sim in simulations.values())
+    print(f'{len(simulations)} simulations, {ntodo} snapshots to diagnose')
+
+    results = diagnose_batch(simulations, workers, cache, slab=conf['CLOUDS'].getint('slab'))
+
+    writers = {}
+    written = {}
+    pending = {sim_name: set(sim[2]) for sim_name, sim in simulations.items()}
+    for sim_name in simulations:
+        writers[sim_name] = diagnostics_writer('./clouds/' + sim_name + '_diagnostics',
+                                               conf['CLOUDS'].get('output', 'text'))
+        written[sim_name] = 0
+
+    def flush(sim_name):
+        sinnums, _ = snapshots[sim_name]
+        while written[sim_name] < len(sinnums) and sinnums[written[sim_name]] not in pending[sim_name]:
+            sinnum = sinnums[written[sim_name]]
+            writers[sim_name].write(sinnum, manifests[sim_name].result(sinnum))
+            written[sim_name] += 1
+
+    try:
+        for sim_name in simulations:
+            flush(sim_name)
+
+        i = 0
+        for sim_name, sinnum, (n_av, T_av, fmix, y_cm, j_sg, v_sg) in results:
+            sinnums, simfiles = snapshots[sim_name]
+            simfile = simfiles[sinnums.index(sinnum)]
+            manifests[sim_name].record(sinnum, simfile, [n_av, T_av, fmix, y_cm] + list(j_sg) + list(v_sg))
+            pending[sim_name].discard(sinnum)
+            flush(sim_name)
+
+            i += 1
+            print(f'Simulation {i} out of {ntodo} done ({sim_name} {sinnum})')
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    print('DIAGNOSE and CUTS done')
+
+def clouds_queue(role, conf, workers, imports):
+    """
+
+    Run the CLOUDS mode through the work queue of the QUEUE section,
+    one task per snapshot, so that workers on several nodes sharing the
+    queue directory can split the simulations of the CONFIG file
+
+    submit: add a task for every snapshot not in the manifest yet
+    work:   run tasks until the queue is empty (--workers local processes)
+    reduce: merge the task results into the usual CLOUDS outputs
+    status: print the number of done, failed, running and waiting tasks
+
+    :role: string, submit, work, reduce or status
+
+    :conf: ConfigParser, CONFIG file
+
+    :workers: int, number of local worker processes
+
+    :imports: ImportProfile
+
+    """
+    WorkQueue = imports.load('.workqueue', __package__).WorkQueue
+
+    queue = WorkQueue(conf['QUEUE']['path'],
+                      stale=conf['QUEUE'].getfloat('stale', 120.0),
+                      heartbeat=conf['QUEUE'].getfloat('heartbeat', 10.0),
+                      maxtries=conf['QUEUE'].getint('maxtries', 3))
+
+    if role == 'status':
+        print(queue.status())
+
+    elif role == 'submit':
+        CutStore = imports.load('.clouds.cut_store', __package__).CutStore
+
+        n = 0
+        for sim_name, simpath, outdir in clouds_simulations(conf):
+            manifest, _ = clouds_outputs(conf, sim_name, CutStore)
+            sinnums, simfiles = clouds_simfiles(conf, simpath)
+
+            for sinnum, simfile in zip(sinnums, simfiles):
+                if not manifest.done(sinnum, simfile):
+                    n += queue.submit(sim_name + '_' + sinnum, {'simname': sim_name, 'simpath': simpath,
+                                                                'outdir': outdir, 'sinnum': sinnum,
+                                                                'simfile': simfile})
+
+        print(f'{n} tasks submitted to ' + queue.path)
+
+    elif role == 'work':
+        if workers > 1:
+            import multiprocessing
+
+            procs = [multiprocessing.Process(target=clouds_queue, args=(role, conf, 1, imports)) for _ in range(workers)]
+            for proc in procs:
+                proc.start()
+            for proc in procs:
+                proc.join()
+
+            print(queue.status())
+            return
+
+        Diagnose          = imports.load('.clouds.diagnose', __package__).Diagnose
+        diagnose_snapshot = imports.load('.clouds.parallel', __package__).diagnose_snapshot
+
+        binary = conf['CLOUDS'].get('cuts', 'binary') == 'binary'
+        diagnoses = {}
+
+        def handler(name, spec):
+            sim_name = spec['simname']
+            if sim_name not in diagnoses:
+                diagnoses[sim_name] = clouds_diagnose(conf, spec['simpath'], Diagnose, spec['outdir'])
+
+            PROFILER.snapshot = name
+            result, planes = diagnose_snapshot(diagnoses[sim_name], spec['simfile'], spec['sinnum'],
+                                               conf['CLOUDS'].getint('slab'), binary)
+
+            n_av, T_av, fmix, y_cm, j_sg, v_sg = result
+            arrays = {'result': np.array([n_av, T_av, fmix, y_cm] + list(j_sg) + list(v_sg), dtype=np.float64)}
+            if planes is not None:
+                for i, (pname, arr, meta) in enumerate(planes):
+                    arrays['plane_' + str(i)] = arr
+                arrays['planes'] = np.array(json.dumps([[pname, meta] for pname, _, meta in planes]))
+
+            return arrays
+
+        for name in queue.work(handler, conf['QUEUE'].getfloat('poll', 5.0)):
+            print(f'Task {name} done by {queue.worker}')
+
+    elif role == 'reduce':
+        CutStore           = imports.load('.clouds.cut_store', __package__).CutStore
+        diagnostics_writer = imports.load('.clouds.writers', __package__).diagnostics_writer
+
+        for sim_name, simpath, outdir in clouds_simulations(conf):
+            manifest, cutstore = clouds_outputs(conf, sim_name, CutStore)
+            sinnums, simfiles  = clouds_simfiles(conf, simpath)
+
+            missing = 0
+            writer  = diagnostics_writer('./clouds/' + sim_name + '_diagnostics',
+                                         conf['CLOUDS'].get('output', 'text'))
+
+            with writer:
+                for sinnum, simfile in zip(sinnums, simfiles):
+                    name = sim_name + '_' + sinnum
+
+                    if not manifest.done(sinnum, simfile):
+                        if not queue.done(name):
+                            missing += 1
+                            continue
+
+                        result = queue.result(name)
+                        if cutstore is not None and 'planes' in result:
+                            planes = [(pname, result['plane_' + str(i)], meta)
+                                      for i, (pname, meta) in enumerate(json.loads(str(result['planes'])))]
+                            cutstore.add(sinnum, planes)
+
+                        manifest.record(sinnum, simfile, list(result['result']))
+
+                    writer.write(sinnum, manifest.result(sinnum))
+
+            print(f'{sim_name}: {len(sinnums) - missing} out of {len(sinnums)} simulations reduced')
+
+        print('DIAGNOSE and CUTS done')
+
+def synthetic_queue(role, conf, workers, imports):
+    """
+
+    Run the SYNTHETIC mode through the work queue of the QUEUE section:
+    one maps task per snapshot (column densities, spectral cubes and the
+    default rays, written by the worker) and one task per batch of
+    sightlines, whose spectra are written by the reduce step
+
+    submit: add the tasks of every snapshot
+    work:   run tasks until the queue is empty (--workers local processes)
+    reduce: write the spectra of the finished sightline batches
+    status: print the number of done, failed, running and waiting tasks
+
+    :role: string, submit, work, reduce or status
+
+    :conf: ConfigParser, CONFIG file
+
+    :workers: int, number of local worker processes
+
+    :imports: ImportProfile
+
+    """
+    WorkQueue = imports.load('.workqueue', __package__).WorkQueue
+    VTKFile   = imports.load('.vtkfile', __package__).VTKFile
+
+    queue = WorkQueue(conf['QUEUE']['path'],
+                      stale=conf['QUEUE'].getfloat('stale', 120.0),
+                      heartbeat=conf['QUEUE'].getfloat('heartbeat', 10.0),
+                      maxtries=conf['QUEUE'].getint('maxtries', 3))
+
+    batch = conf['SYNTHETIC'].getint('spectra_batch', 64)
+
+    def label(sinnum):
+        return 'synthetic_' + (sinnum if sinnum is not None else 'snapshot')
+
+    def batches(simfile):
+        sightlines = synthetic_sightlines(conf, VTKFile(simfile).shape, imports)
+        if sightlines is None:
+            return None, []
+
+        return sightlines, [slice(i, i + batch) for i in range(0, len(sightlines[0]), batch)]
+
+    if role == 'status':
+        print(queue.status())
+
+    elif role == 'submit':
+        n = 0
+        for sinnum, simfile in zip(*synthetic_simfiles(conf)):
+            spec = {'simfile': simfile, 'sinnum': sinnum}
+            n += queue.submit(label(sinnum) + '_maps', dict(spec, task='maps'))
+
+            for b, sl in enumerate(batches(simfile)[1]):
+                n += queue.submit(label(sinnum) + '_spectra_' + str(b).zfill(4),
+                                  dict(spec, task='spectra', batch=b, start=sl.start, stop=sl.stop))
+
+        print(f'{n} tasks submitted to ' + queue.path)
+
+    elif role == 'work':
+        if workers > 1:
+            import multiprocessing
+
+            procs = [multiprocessing.Process(target=synthetic_queue, args=(role, conf, 1, imports)) for _ in range(workers)]
+            for proc in procs:
+                proc.start()
+            for proc in procs:
+                proc.join()
+
+            print(queue.status())
+            return
+
+        state = {'setup': None, 'observables': None, 'simfile': None, 'sightlines': None}
+
+        def handler(name, spec):
+            if state['setup'] is None:
+                state['setup'] = synthetic_setup(conf, imports)
+
+            if spec['simfile'] != state['simfile']:
+                state['observables'] = synthetic_observables(conf, state['observables'], spec['simfile'],
+                                                             spec['sinnum'], state['setup'], imports)
+                state['simfile'] = spec['simfile']
+
+            observables = state['observables']
+
+            if spec['task'] == 'maps':
+                synthetic_maps(conf, observables)
+                if 'sightlines' not in conf['SYNTHETIC']:
+                    observables.get_mock_spectra()
+                return {}
+
+            if state['sightlines'] is None:
+                state['sightlines'] = synthetic_sightlines(conf, observables.shape, imports)
+
+            sl = slice(spec['start'], spec['stop'])
+            velocity, fluxes = observables.get_spectra_batch(*[arr[sl] for arr in state['sightlines']])
+
+            arrays = {'velocity': velocity, 'ions': np.array(list(fluxes))}
+            for i, flux in enumerate(fluxes.values()):
+                arrays['flux_' + str(i)] = flux
+
+            return arrays
+
+        for name in queue.work(handler, conf['QUEUE'].getfloat('poll', 5.0)):
+            print(f'Task {name} done by {queue.worker}')
+
+    elif role == 'reduce':
+        write_batch = imports.load('.synthetic.sightlines', __package__).write_batch
+
+        sinnums, simfiles = synthetic_simfiles(conf)
+        for sinnum, simfile in zip(sinnums, simfiles):
+            obs = synthetic_outdir(sinnum)
+            os.makedirs(obs, exist_ok=True)
+
+            sightlines, slices = batches(simfile)
+            missing = 0 if queue.done(label(sinnum) + '_maps') else 1
+
+            for b, sl in enumerate(slices):
+                name = label(sinnum) + '_spectra_' + str(b).zfill(4)
+                if not queue.done(name):
+                    missing += 1
+                    continue
+
+                result = queue.result(name)
+                fluxes = {str(ion): result['flux_' + str(i)] for i, ion in enumerate(result['ions'])}
+                write_batch(obs, b, *[arr[sl] for arr in sightlines], result['velocity'], fluxes)
+
+            print(f'{label(sinnum)}: {len(slices) + 1 - missing} out of {len(slices) + 1} tasks reduced')
+
+        print('Mock absorption spectra DONE')
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
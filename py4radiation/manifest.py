@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import os
+import json
+
+from .cache import content_hash
+
+class Manifest():
+    """
+
+    Per-run manifest of the processed snapshots
+
+    For every snapshot it records the input file, its size, modification
+    time and content hash, and the results. A snapshot is done when it
+    is in the manifest and its file is unchanged; files whose size or
+    modification time changed are hashed again to tell whether their
+    content changed. If the settings of the run differ from the ones
+    in the manifest, all the snapshots are processed again
+
+    :path: string
+
+        Path to the manifest file (JSON)
+
+    :settings: dict, optional
+
+        JSON-serialisable settings that the results depend on
+
+    """
+
+    def __init__(self, path, settings=None):
+        self.path     = path
+        self.settings = settings if settings is not None else {}
+
+        if os.path.isfile(path):
+            with open(path) as f:
+                data = json.load(f)
+        else:
+            data = {}
+
+        if data.get('settings') == self.settings:
+            self.snapshots = data.get('snapshots', {})
+        else:
+            self.snapshots = {}
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def flush(self):
+        """
+
+        Write the manifest atomically to disk
+
+        """
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'settings': self.settings, 'snapshots': self.snapshots}, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def done(self, sinnum, simfile):
+        """
+
+        Whether a snapshot is processed and its file unchanged
+
+        :sinnum: string, number of the simulation
+
+        :simfile: string, path to the simulation file
+
+        """
+        entry = self.snapshots.get(sinnum)
+        if entry is None:
+            return False
+
+        stat = os.stat(simfile)
+        if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            return True
+
+        if entry['size'] == stat.st_size and entry['hash'] == content_hash(simfile):
+            entry['mtime'] = stat.st_mtime_ns
+            self.flush()
+            return True
+
+        return False
+
+    def record(self, sinnum, simfile, result):
+        """
+
+        Record a processed snapshot
+
+        :sinnum: string, number of the simulation
+
+        :simfile: string, path to the simulation file
+
+        :result: list of floats
+
+        """
+        stat = os.stat(simfile)
+
+        self.snapshots[sinnum] = {
+            'file': os.path.abspath(simfile),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'hash': content_hash(simfile),
+            'result': [float(r) for r in result]
+        }
+        self.flush()
+
+    def result(self, sinnum):
+        """
+
+        Recorded result of a snapshot
+
+        """
+        return self.snapshots[sinnum]['result']
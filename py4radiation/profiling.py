@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def _io():
+    """
+
+    Bytes read from and written to storage by this process so far
+    (Linux only, zero elsewhere)
+
+    """
+    counters = {}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, value = line.split(':')
+                counters[key] = int(value)
+    except OSError:
+        None
+
+    return counters.get('read_bytes', 0), counters.get('write_bytes', 0)
+
+def _process_peak_rss():
+    """
+
+    Peak resident set size of this process over its lifetime in bytes
+
+    """
+    if resource is None:
+        return 0
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _hwm():
+    """
+
+    High-water mark of the resident set size (VmHWM) in bytes,
+    None where /proc is not available
+
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        None
+
+    return None
+
+def _reset_hwm():
+    """
+
+    Reset the high-water mark to the current resident set size
+    (Linux only)
+
+    :return: True if it was reset
+
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+class Profiler():
+    """
+
+    Record wall time, CPU time, bytes read/written and peak memory
+    of every stage of a run, per snapshot
+
+    The peak memory of a stage (peak_rss) is the high-water mark of the
+    resident set size while the stage runs, reset at its start through
+    /proc/self/clear_refs (Linux); where that is not possible it falls
+    back to the peak of the process so far, like process_peak_rss.
+    Stages may overlap across threads (e.g. the snapshot prefetcher):
+    the CPU time of a stage is that of its own thread, while the memory
+    and I/O counters are process-wide
+
+    Recording is off until the profiler is enabled, so instrumented
+    code pays a single attribute check. The events can be exported
+    as JSON or in the Chrome trace format (chrome://tracing, Perfetto)
+
+    """
+
+    def __init__(self):
+        self.enabled  = False
+        self.snapshot = None
+        self.events   = []
+
+        self._open  = {}   # peak memory of every open stage, by token
+        self._peak  = 0
+        self._lock  = threading.Lock()
+
+    def _stage_peak(self):
+        """
+
+        Fold the current high-water mark into the peaks of the open
+        stages, before it is reset for a new one
+
+        """
+        hwm = _hwm()
+        if hwm is not None:
+            for token in self._open:
+                self._open[token] = max(self._open[token], hwm)
+            self._peak = max(self._peak, hwm)
+
+    @contextmanager
+    def stage(self, name, snapshot=None):
+        """
+
+        Record a stage
+
+        :name: string, name of the stage
+
+        :snapshot: string, optional, snapshot the stage works on
+                   (default: the current snapshot of the profiler)
+
+        """
+        if not self.enabled:
+            yield
+            return
+
+        with self._lock:
+            self._stage_peak()
+            reset = _reset_hwm()
+            token = object()
+            self._open[token] = 0
+
+        start = time.time()
+        read0, write0 = _io()
+        wall0 = time.perf_counter()
+        cpu0  = time.thread_time()
+
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall0
+            cpu  = time.thread_time() - cpu0
+            read1, write1 = _io()
+
+            with self._lock:
+                self._stage_peak()
+                peak = self._open.pop(token)
+
+            # resetting the high-water mark also resets ru_maxrss on Linux
+            process_peak = max(self._peak, _process_peak_rss())
+
+            self.events.append({
+                'stage': name,
+                'snapshot': snapshot if snapshot is not None else self.snapshot,
+                'start': start,
+                'wall': wall,
+                'cpu': cpu,
+                'read_bytes': read1 - read0,
+                'write_bytes': write1 - write0,
+                'peak_rss': peak if reset and peak else process_peak,
+                'process_peak_rss': process_peak,
+                'pid': os.getpid(),
+                'tid': threading.get_ident()
+            })
+
+    def drain(self):
+        """
+
+        Remove and return the recorded events (e.g. to send them
+        from a worker process to the main one)
+
+        """
+        events, self.events = self.events, []
+        return events
+
+    def summary(self):
+        """
+
+        Totals per stage
+
+        """
+        stages = {}
+        for event in self.events:
+            total = stages.setdefault(event['stage'], {'calls': 0, 'wall': 0.0, 'cpu': 0.0,
+                                                       'read_bytes': 0, 'write_bytes': 0, 'peak_rss': 0})
+            total['calls'] += 1
+            for key in ['wall', 'cpu', 'read_bytes', 'write_bytes']:
+                total[key] += event[key]
+            total['peak_rss'] = max(total['peak_rss'], event['peak_rss'])
+
+        return stages
+
+    def to_json(self, path):
+        """
+
+        Export the events and the totals per stage as JSON
+
+        """
+        with open(path, 'w') as f:
+            json.dump({'stages': self.summary(), 'events': self.events}, f, indent=1)
+
+    def to_chrome_trace(self, path):
+        """
+
+        Export the events in the Chrome trace event format
+
+        """
+        t0 = min((event['start'] for event in self.events), default=0)
+
+        trace = []
+        for event in self.events:
+            trace.append({
+                'name': event['stage'],
+                'cat': 'py4radiation',
+                'ph': 'X',
+                'ts': (event['start'] - t0) * 1e6,
+                'dur': event['wall'] * 1e6,
+                'pid': event['pid'],
+                'tid': event['tid'],
+                'args': {key: event[key] for key in ['snapshot', 'cpu', 'read_bytes', 'write_bytes',
+                                                     'peak_rss', 'process_peak_rss']}
+            })
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+PROFILER = Profiler()
+
+def profiled(name):
+    """
+
+    Decorator recording every call of a function as a stage
+
+    :name: string, name of the stage
+
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with PROFILER.stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
@@ -1,33 +1,84 @@
 #!/usr/bin/env python3
 
-import vtk
-import numpy as np
+import os
 
-def simload(filename):
+from .vtkfile import VTKFile
+from .profiling import PROFILER
+from .cache import SnapshotCache
+
+VAR_NAMES = ['rho', 'tr1', 'prs', 'vx1', 'vx2', 'vx3']
+
+_cache = None
+
+def set_cache(path, maxsize=None, compression=None):
+    """
+
+    Enable (or disable, with path=None) the converted-snapshot cache
+    that simload checks transparently
+
+    **Parameters**
+
+    :path: string, directory of the cache
+
+    :maxsize: string or int, optional, size cap of the cache (e.g. 50G)
+
+    :compression: string, optional, None or zlib
+
+    :return: SnapshotCache or None
+
+    """
+    global _cache
+
+    if path is None:
+        _cache = None
+    else:
+        _cache = SnapshotCache(path, maxsize, compression)
+
+    return _cache
+
+def get_cache():
+    """
+
+    Converted-snapshot cache used by simload, None if disabled
+
+    """
+    return _cache
+
+def simload(filename, fields=None, box=None):
     """
 
     Load a VTK simulation file and obtain FIELDS and DIMENSIONS (shape)
 
+    Fields are memory-mapped big-endian views of the file,
+    so no data is read until the arrays are used. If a cache is
+    enabled with set_cache, the fields are loaded from the converted
+    snapshot in the cache instead
+
     **Parameters**
 
     :file: string, path to simulation file
 
-    :return: scalar/vector fields, dimensions
+    :fields: list of strings, optional
+
+        Names of the fields to load, in the order they are returned
+        (default: rho, tr1, prs, vx1, vx2, vx3)
+
+    :box: tuple of slices or list of [start, stop] index pairs, optional
+
+        Sub-box of the computational domain to load, one entry per axis
+
+    :return: scalar/vector fields, dimensions (of the sub-box)
 
     """
 
-    reader = vtk.vtkDataSetReader()
-    reader.SetFileName(filename)
-    reader.ReadAllScalarsOn()
-    reader.ReadAllVectorsOn()
-    reader.Update()
+    if fields is None:
+        fields = VAR_NAMES
 
-    data  = reader.GetOutput()
-    dims  = data.GetDimensions()
-    shape = tuple(d - 1 for d in dims)
+    with PROFILER.stage('simload', os.path.basename(filename)):
+        if _cache is not None:
+            return _cache.load(filename, fields, box)
 
-    cell_data = data.GetCellData()
-    var_names = ['rho', 'tr1', 'prs', 'vx1', 'vx2', 'vx3']
-    fields    = [np.array(cell_data.GetArray(name)).reshape(shape, order='F') for name in var_names]
+        vtkfile  = VTKFile(filename)
+        _, shape = vtkfile.subbox(box)
 
-    return fields, shape
+        return [vtkfile.field(name, box) for name in fields], shape
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import time
+import glob
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .simload import simload, VAR_NAMES
+from .vtkfile import VTKFile
+from .cache import parse_size
+from .profiling import PROFILER
+
+def find_snapshots(simpath, pattern='data.*.dat', first=None, last=None, stride=1):
+    """
+
+    Find the simulation files of a run, sorted by snapshot number
+
+    **Parameters**
+
+    :simpath: string, path to the simulation directory
+
+    :pattern: string, optional, glob pattern of the simulation files
+
+    :first: int, optional, first snapshot number
+
+    :last: int, optional, last snapshot number (included)
+
+    :stride: int, optional, keep every stride-th snapshot
+
+    :return: snapshot numbers (strings, as in the file names), simulation files
+
+    """
+    found = []
+    for simfile in glob.glob(os.path.join(simpath, pattern)):
+        num = re.search(r'(\d+)\D*$', os.path.basename(simfile))
+        if num is None:
+            continue
+
+        n = int(num.group(1))
+        if (first is None or n >= first) and (last is None or n <= last):
+            found.append((n, num.group(1), simfile))
+
+    found.sort()
+    found = found[::stride]
+
+    return [f[1] for f in found], [f[2] for f in found]
+
+def readsim(filename, fields=None, box=None):
+    """
+
+    Load a simulation file into memory (native byte order)
+
+    **Parameters**
+
+    :filename: string, path to simulation file
+
+    :fields: list of strings, optional, names of the fields to load
+
+    :box: tuple of slices or list of [start, stop] index pairs, optional
+
+    :return: scalar/vector fields, dimensions
+
+    """
+    with PROFILER.stage('readsim', os.path.basename(filename)):
+        data, shape = simload(filename, fields, box)
+        data = [np.array(f, dtype=f.dtype.newbyteorder('='), order='F') for f in data]
+
+    return data, shape
+
+class SnapshotPrefetcher():
+    """
+
+    Iterate over simulation files while the upcoming ones are read
+    on background I/O threads
+
+    Iterating yields (fields, shape) for every simulation file, in order.
+    At most depth snapshots are read ahead of the one being analysed,
+    and no new read starts while the snapshots in memory would exceed
+    the memory ceiling
+
+    :simfiles: list of strings
+
+        Paths to the simulation files
+
+    :fields: list of strings, optional
+
+        Names of the fields to load (default: all)
+
+    :box: tuple of slices or list of [start, stop] index pairs, optional
+
+        Sub-box of the computational domain to load
+
+    :depth: int, optional
+
+        Number of snapshots read ahead (0 reads them in sequence)
+
+    :maxmem: string or int, optional
+
+        Memory ceiling of the snapshots in memory (e.g. 16G)
+
+    :workers: int, optional
+
+        Number of I/O threads
+
+    """
+
+    def __init__(self, simfiles, fields=None, box=None, depth=2, maxmem=None, workers=1):
+        self.simfiles = list(simfiles)
+        self.fields   = fields
+        self.box      = box
+        self.depth    = depth
+        self.maxmem   = parse_size(maxmem)
+        self.workers  = max(1, workers)
+
+    def nbytes(self, simfile):
+        """
+
+        Memory needed to hold the requested fields of a simulation file
+
+        :simfile: string
+
+        """
+        vtkfile  = VTKFile(simfile)
+        _, shape = vtkfile.subbox(self.box)
+
+        nbytes = 0
+        for name in (self.fields if self.fields is not None else VAR_NAMES):
+            _, dtype, ncomp = vtkfile.arrays[name]
+            nbytes += int(np.prod(shape)) * dtype.itemsize * ncomp
+
+        return nbytes
+
+    def __len__(self):
+        return len(self.simfiles)
+
+    def __iter__(self):
+        if self.depth < 1:
+            for simfile in self.simfiles:
+                yield readsim(simfile, self.fields, self.box)
+            return
+
+        pool    = ThreadPoolExecutor(self.workers)
+        pending = deque()
+        inmem   = 0
+        nxt     = 0
+
+        try:
+            while nxt < len(self.simfiles) or pending:
+                while nxt < len(self.simfiles) and len(pending) < self.depth:
+                    size = self.nbytes(self.simfiles[nxt])
+                    if pending and self.maxmem is not None and inmem + size > self.maxmem:
+                        break
+
+                    future = pool.submit(readsim, self.simfiles[nxt], self.fields, self.box)
+                    pending.append((future, size))
+                    inmem += size
+                    nxt   += 1
+
+                future, size = pending.popleft()
+                yield future.result()
+                inmem -= size
+        finally:
+            for future, _ in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+class SnapshotWatcher():
+    """
+
+    Follow a running simulation and yield its snapshots as soon as
+    they have been completely written
+
+    A snapshot is complete once its header declares all the fields and
+    the file is long enough to hold them, and it has not been modified
+    for settle seconds. Snapshots are yielded in order of their number.
+    Between outputs the watcher only stats the directory, polling less
+    and less often (up to maxpoll seconds) while nothing changes, and
+    goes back to fast polling as soon as a new file appears
+
+    :simpath: string
+
+        Path to the simulation directory
+
+    :pattern: string, optional
+
+        Glob pattern of the simulation files
+
+    :fields: list of strings, optional
+
+        Fields a snapshot must hold to be complete (default: all)
+
+    :first: int, optional
+
+        First snapshot number
+
+    :last: int, optional
+
+        Last snapshot number, the watcher stops after it
+
+    :stride: int, optional
+
+        Keep every stride-th snapshot
+
+    :poll: float, optional
+
+        Fastest polling interval in seconds
+
+    :maxpoll: float, optional
+
+        Slowest polling interval in seconds
+
+    :settle: float, optional
+
+        Seconds without modification before a file counts as complete
+
+    :timeout: float, optional
+
+        Stop after this many seconds without a new snapshot
+        (default: follow until the last snapshot or an interrupt)
+
+    """
+
+    def __init__(self, simpath, pattern='data.*.dat', fields=None, first=None, last=None, stride=1,
+                 poll=0.5, maxpoll=10.0, settle=0.5, timeout=None):
+        self.simpath = simpath
+        self.pattern = pattern
+        self.fields  = fields if fields is not None else VAR_NAMES
+        self.first   = first
+        self.last    = last
+        self.stride  = stride
+        self.poll    = poll
+        self.maxpoll = maxpoll
+        self.settle  = settle
+        self.timeout = timeout
+
+        self.yielded = set()
+
+    def complete(self, simfile):
+        """
+
+        Whether a simulation file has been completely written
+
+        :simfile: string
+
+        """
+        try:
+            stat = os.stat(simfile)
+            size = VTKFile(simfile).datasize(self.fields)
+        except Exception:
+            return False
+
+        return size is not None and stat.st_size >= size and time.time() - stat.st_mtime >= self.settle
+
+    def skip(self, sinnums):
+        """
+
+        Mark snapshots as already processed
+
+        :sinnums: list of strings, snapshot numbers
+
+        """
+        self.yielded.update(sinnums)
+
+    def __iter__(self):
+        interval = self.poll
+        mtime    = None
+        pending  = False
+        latest   = time.time()
+
+        while True:
+            stamp = os.stat(self.simpath).st_mtime
+
+            if pending or stamp != mtime:
+                mtime = stamp
+                sinnums, simfiles = find_snapshots(self.simpath, self.pattern, self.first, self.last, self.stride)
+
+                pending = False
+                new     = False
+                for sinnum, simfile in zip(sinnums, simfiles):
+                    if sinnum in self.yielded:
+                        continue
+
+                    new = True
+                    if not self.complete(simfile):
+                        pending = True
+                        break
+
+                    self.yielded.add(sinnum)
+                    latest = time.time()
+                    yield sinnum, simfile
+
+                    if self.last is not None and int(sinnum) >= self.last:
+                        return
+
+                if new:
+                    interval = self.poll
+
+            if self.timeout is not None and time.time() - latest > self.timeout:
+                return
+
+            time.sleep(interval)
+            if not pending:
+                interval = min(2 * interval, self.maxpoll)
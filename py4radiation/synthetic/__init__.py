@@ -1,3 +1,3 @@
 #!/usr/bin/env python3
 
-__all__ = ['absorption_spectrum', 'column_density', 'observables']
\ No newline at end of file
+__all__ = ['absorption_spectrum', 'column_density', 'column_store', 'ion_table', 'observables', 'sightlines', 'spectral_cube']
\ No newline at end of file
@@ -5,6 +5,8 @@ import trident
 
 import numpy as np
 
+from ..profiling import profiled
+
 class MockSpectra():
     """
 
@@ -39,7 +41,11 @@ class MockSpectra():
         self.ions = species
         self.obs  = './observables/'
 
-    def raymaker(self, ray_name, start, end):
+        self.raypath    = self.obs
+        self.generators = {}
+
+    @profiled('raymaker')
+    def raymaker(self, ray_name, start, end, verbose=True):
         """
 
         Generate rays across the cloud
@@ -55,20 +61,26 @@ class MockSpectra():
         :end: list
 
             Rectangular coordinates of the ending point of the ray
+
+        :verbose: bool, optional
+
+            Print a line when the ray is created
         
         """
 
         ray = trident.make_simple_ray(self.ds,
                                 start_position = start,
                                 end_position = end,
-                                data_filename = self.obs + 'ray_' + ray_name + '.h5',
+                                data_filename = self.raypath + 'ray_' + ray_name + '.h5',
                                 lines = self.ions,
                                 ftype = 'gas',
                                 redshift = 0)
         
-        print(f'Ray {ray_name} created')
+        if verbose:
+            print(f'Ray {ray_name} created')
         return ray
         
+    @profiled('getSpectrum')
     def getSpectrum(self, ray, ray_name):
         """
 
@@ -87,7 +99,45 @@ class MockSpectra():
         """
 
         for i in self.ions:
-            spec = trident.SpectrumGenerator(lambda_min=-500, lambda_max=0, dlambda=1, bin_space='velocity')
+            spec = self.generator(i)
             spec.make_spectrum(ray, lines=[i])
             spec.save_spectrum(self.obs + i + '_ray_' + ray_name + '.dat')
-            print(f'Ion {i} DONE')
\ No newline at end of file
+            print(f'Ion {i} DONE')
+
+    def generator(self, ion):
+        """
+
+        Spectrum generator of an ion, created once and cleared for every ray
+
+        :ion: string, e.g. O VI
+
+        """
+        if ion not in self.generators:
+            self.generators[ion] = trident.SpectrumGenerator(lambda_min=-500, lambda_max=0, dlambda=1,
+                                                             bin_space='velocity')
+        else:
+            self.generators[ion].clear_spectrum()
+
+        return self.generators[ion]
+
+    @profiled('spectra')
+    def spectra(self, ray):
+        """
+
+        Mock absorption spectra of all the given ions along a ray,
+        without writing them
+
+        :ray: string
+
+            Filename of ray, including path
+
+        :return: dict of (velocity, flux) numpy arrays by ion
+
+        """
+        spectra = {}
+        for i in self.ions:
+            spec = self.generator(i)
+            spec.make_spectrum(ray, lines=[i])
+            spectra[i] = (np.array(spec.lambda_field), np.array(spec.flux_field))
+
+        return spectra
\ No newline at end of file
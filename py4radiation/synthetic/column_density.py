@@ -1,11 +1,71 @@
 #/usr/bin/env python3
 
 import os
+import shutil
 import numpy as np
 
+from ..profiling import profiled
+from .column_store import ColumnStore
+
+def column_densities(densities, shape, dl, axes=(0, 1), block=None):
+    """
+
+    Integrate number density fields of a uniform grid along grid axes
+    in a single blocked sweep over z-slabs: every slab of every ion is
+    read once and reduced along all the requested axes while it is in cache
+
+    **Parameters**
+
+    :densities: dict
+
+        Number density of every ion (cm^-3), either a 3D array or a
+        function f(k0, k1) returning the z-slab [k0, k1) of it
+
+    :shape: tuple, dimensions of the grid
+
+    :dl: list of floats, cell lengths along x, y, z (cm)
+
+    :axes: tuple, optional, axes to integrate along (0: x, 1: y, 2: z)
+
+    :block: int, optional, number of z-planes per slab
+
+    :return: dict of dicts, column density maps (cm^-2) by ion and axis,
+             indexed [y, z] when integrated along x, [x, z] along y
+             and [x, y] along z
+
+    """
+    nx, ny, nz = shape
+    if block is None:
+        block = max(1, 2**20 // (nx * ny))
+
+    if any(axis not in [0, 1, 2] for axis in axes):
+        raise Exception('Column density axes: 0 (x), 1 (y), 2 (z)')
+
+    maps = {}
+    for ion in densities:
+        maps[ion] = {axis: np.zeros([n for i, n in enumerate(shape) if i != axis]) for axis in axes}
+
+    for k0 in range(0, nz, block):
+        k1 = min(k0 + block, nz)
+
+        for ion, n in densities.items():
+            slab = n(k0, k1) if callable(n) else n[:, :, k0:k1]
+
+            for axis in axes:
+                if axis == 2:
+                    maps[ion][axis] += slab.sum(axis=axis, dtype=np.float64)
+                else:
+                    maps[ion][axis][:, k0:k1] = slab.sum(axis=axis, dtype=np.float64)
+
+    for ion in maps:
+        for axis in axes:
+            maps[ion][axis] *= dl[axis]
+
+    return maps
+
 class ColumnDensity():
     """
-    
+
     Generate column density maps for wind-cloud simulations
     in down-the-barrel and transverse views
 
@@ -22,22 +82,106 @@ class ColumnDensity():
         Ions chosen for analysis
         They must be consistent with the ion fractions file for Trident
 
+    :engine: string, optional
+
+        native (default): integrate the uniform grid directly, all ions
+        and both views in one sweep
+        yt: one yt projection per ion and view
+
+    :densities: dict, optional
+
+        Number density of every ion on the grid (cm^-3), e.g. from
+        IonFractions (default: sampled from the yt dataset)
+
     """
 
-    def __init__(self, ds, shape, ions):
+    def __init__(self, ds, shape, ions, engine='native', densities=None):
         self.ds = ds
         self.shape = shape
         elements = ions[:, 0]
         ionnums  = ions[:, 1].astype(int)
 
+        if engine not in ['native', 'yt']:
+            raise Exception('Column density engines: native, yt')
+
         species = []
         for i in range(len(elements)):
             species.append(elements[i] + '_p' + str(ionnums[i] - 1))
 
-        self.ions = species
+        self.ions   = species
+        self.engine = engine
+        self.maps   = None
+
+        self._densities = densities
 
         self.obs = './observables/'
 
+    def densities(self):
+        """
+
+        Number density fields of the ions on the uniform grid (cm^-3):
+        the given arrays, or functions f(k0, k1) sampling the z-slab
+        [k0, k1) from the yt dataset, so that only one slab of the
+        grid is held in memory at a time
+
+        """
+        if self._densities is not None:
+            return {ion: self._densities[ion] for ion in self.ions}
+
+        ds   = self.ds
+        dz   = (ds.domain_width / ds.domain_dimensions)[2]
+        slab = {}
+
+        def region(k0, k1):
+            if slab.get('k') != (k0, k1):
+                left = ds.domain_left_edge.copy()
+                left[2] += k0 * dz
+                dims = ds.domain_dimensions.copy()
+                dims[2] = k1 - k0
+
+                slab['k']    = (k0, k1)
+                slab['grid'] = ds.covering_grid(0, left, dims)
+
+            return slab['grid']
+
+        def density(ion):
+            return lambda k0, k1: region(k0, k1)[('gas', ion + '_number_density')].in_units('cm**-3').d
+
+        return {ion: density(ion) for ion in self.ions}
+
+    @profiled('column_densities')
+    def project(self):
+        """
+
+        Get the XZ and YZ column density maps of every ion with the native engine
+
+        """
+        if self.maps is None:
+            dl = (self.ds.domain_width.in_units('cm').d / self.ds.domain_dimensions).tolist()
+            self.maps = column_densities(self.densities(), self.shape, dl)
+
+        return self.maps
+
+    def _map(self, ion, axis):
+        """
+
+        Column density map of an ion along x (axis 0) or y (axis 1)
+
+        """
+        if self.engine == 'native':
+            return self.project()[ion][axis]
+
+        proj = self.ds.proj(ion + '_number_density', 'xy'[axis])
+        arr  = np.array(proj[(ion + '_number_density')])
+
+        return np.reshape(arr, (self.shape[1 - axis], self.shape[2]))
+
+    def _write(self, arr, ion, view):
+        fig_arr = '\n'.join(['\t'.join(map(str, row)) for row in arr])
+        with open(self.obs + ion + '_' + view + '.dat', 'w') as file:
+            file.write(fig_arr)
+
+    @profiled('projYZ')
     def projYZ(self):
         """
 
@@ -45,15 +189,9 @@ class ColumnDensity():
 
         """
         for i in range(len(self.ions)):
-            proj = self.ds.proj(self.ions[i] + '_number_density', 'x')
-            arr  = np.array(proj[(self.ions[i] + 'number_density')])
-            arr  = np.reshape(arr, (self.shape[1], self.shape[2]))
-
-            fig_arr = '\n'.join(['\t'.join(map(str, row)) for row in arr])
-            file_yz = self.obs + self.ions[i] + '_yz.dat'
-            with open(file_yz, 'w') as file:
-                file.write(fig_arr)
+            self._write(self._map(self.ions[i], 0), self.ions[i], 'yz')
 
+    @profiled('projXZ')
     def projXZ(self):
         """
 
@@ -61,11 +199,32 @@ class ColumnDensity():
 
         """
         for i in range(len(self.ions)):
-            proj = self.ds.proj(self.ions[i] + '_number_density', 'y')
-            arr  = np.array(proj[(self.ions[i] + 'number_density')])
-            arr  = np.reshape(arr, (self.shape[0], self.shape[2]))
-
-            fig_arr = '\n'.join(['\t'.join(map(str, row)) for row in arr])
-            file_xz = self.obs + self.ions[i] + '_xz.dat'
-            with open(file_xz, 'w') as file:
-                file.write(fig_arr)
\ No newline at end of file
+            self._write(self._map(self.ions[i], 1), self.ions[i], 'xz')
+
+    @profiled('column_archive')
+    def archive(self, compression=None, levels=(1, 2, 4, 8), tile=256, dtype='float64'):
+        """
+
+        Write the XZ and YZ maps of every ion, with their coarser
+        levels, into one binary archive (observables/columns/, see
+        ColumnStore), replacing any previous archive
+
+        :compression: string, optional, None (default) or zlib
+
+        :levels: tuple of ints, optional, block sizes of the levels
+
+        :tile: int, optional, tile size in pixels
+
+        :dtype: string, optional, precision of the stored maps
+
+        :return: ColumnStore
+
+        """
+        shutil.rmtree(self.obs + 'columns/', ignore_errors=True)
+        store = ColumnStore(self.obs + 'columns/', compression)
+
+        for ion in self.ions:
+            store.add(ion, 'xz', self._map(ion, 1), levels, tile, dtype)
+            store.add(ion, 'yz', self._map(ion, 0), levels, tile, dtype)
+
+        return store
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from ..chunkstore import ChunkStore
+from ..profiling import profiled
+
+def block_sum(arr, factor):
+    """
+
+    Sum a 2D map over factor x factor blocks of pixels; the blocks at
+    the upper edges are partial when the map is not a multiple of factor
+
+    :arr: numpy array
+
+    :factor: int
+
+    :return: numpy array of shape ceil(n / factor) along each axis
+
+    """
+    if factor == 1:
+        return arr
+
+    arr = np.add.reduceat(arr, np.arange(0, arr.shape[0], factor), axis=0)
+    arr = np.add.reduceat(arr, np.arange(0, arr.shape[1], factor), axis=1)
+
+    return arr
+
+class ColumnStore():
+    """
+
+    Binary archive of the column density maps of a snapshot
+
+    The maps of every ion and view are kept in a single ChunkStore,
+    with one data file (columns.bin) for all of them, as
+    <ion>_<view>/<level> arrays split into square tiles, with the
+    full-resolution map at level 1 and maps summed over 2x2, 4x4, ...
+    blocks of pixels at the coarser levels, so a coarse view of a map
+    is read without decoding the full-resolution one and a region of a
+    map only decodes the tiles it covers. The mean column density of a
+    block is the stored sum divided by level**2
+
+    :path: string
+
+        Directory of the archive
+
+    :compression: string, optional
+
+        None (default) or zlib
+
+    """
+
+    def __init__(self, path, compression=None):
+        self.store = ChunkStore(path, compression, datafile='columns.bin')
+
+    def _name(self, ion, view, level):
+        return ion + '_' + view + '/' + str(level)
+
+    @profiled('columnstore')
+    def add(self, ion, view, arr, levels=(1, 2, 4, 8), tile=256, dtype='float64'):
+        """
+
+        Write the map of an ion and view, and its coarser levels
+
+        :ion: string, e.g. O_p5
+
+        :view: string, xz (down the barrel) or yz (transverse)
+
+        :arr: 2D numpy array, column densities (cm^-2)
+
+        :levels: tuple of ints, optional, block sizes of the levels
+
+        :tile: int, optional, tile size in pixels
+
+        :dtype: string, optional, precision of the stored maps
+                (float64 by default, float32 halves the archive)
+
+        """
+        arr = np.asarray(arr, dtype=np.float64)
+
+        for level in levels:
+            attrs = {'ion': ion, 'view': view, 'level': int(level),
+                     'shape': list(arr.shape), 'units': 'cm**-2', 'reduction': 'sum'}
+            self.store.write(self._name(ion, view, level), block_sum(arr, level).astype(dtype),
+                             chunks=(tile, tile), attrs=attrs)
+
+    def maps(self):
+        """
+
+        (ion, view) of the stored maps
+
+        """
+        found = []
+        for name in self.store.names():
+            attrs = self.store.attrs(name)
+            if (attrs['ion'], attrs['view']) not in found:
+                found.append((attrs['ion'], attrs['view']))
+
+        return found
+
+    def levels(self, ion, view):
+        """
+
+        Stored levels of a map, finest first
+
+        """
+        return sorted(self.store.attrs(name)['level'] for name in self.store.names()
+                      if name.startswith(ion + '_' + view + '/'))
+
+    def read(self, ion, view, level=1, box=None):
+        """
+
+        Read a map, or a region of it
+
+        :ion: string, e.g. O_p5
+
+        :view: string, xz or yz
+
+        :level: int, optional, block size of the level (default: full resolution)
+
+        :box: tuple of slices, optional, region in pixels of that level
+
+        :return: 2D numpy array, column densities (cm^-2) summed over
+                 level x level blocks
+
+        """
+        name = self._name(ion, view, level)
+        if name not in self.store:
+            raise Exception('No level ' + str(level) + ' of ' + ion + ' ' + view + ' in ' + self.store.path)
+
+        return self.store.read(name, box)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from ..profiling import profiled
+
+# Solar abundances by number relative to hydrogen (as in Cloudy and Trident)
+SOLAR_ABUNDANCE = {
+    'H' : 1.00e+00, 'He': 1.00e-01, 'Li': 2.04e-09, 'Be': 2.63e-11, 'B' : 6.17e-10,
+    'C' : 2.45e-04, 'N' : 8.51e-05, 'O' : 4.90e-04, 'F' : 3.02e-08, 'Ne': 1.00e-04,
+    'Na': 2.14e-06, 'Mg': 3.47e-05, 'Al': 2.95e-06, 'Si': 3.47e-05, 'P' : 3.20e-07,
+    'S' : 1.84e-05, 'Cl': 1.91e-07, 'Ar': 2.51e-06, 'K' : 1.32e-07, 'Ca': 2.29e-06,
+    'Sc': 1.48e-09, 'Ti': 1.05e-07, 'V' : 1.00e-08, 'Cr': 4.68e-07, 'Mn': 2.88e-07,
+    'Fe': 2.82e-05, 'Co': 8.32e-08, 'Ni': 1.78e-06, 'Cu': 1.62e-08, 'Zn': 3.98e-08
+}
+
+X_H = 0.76          # hydrogen mass fraction
+M_H = 1.6737e-24    # mass of the hydrogen atom in g
+
+class IonTable():
+    """
+
+    Ion fractions from a CIAOLoop ion-balance run (see
+    ParameterFiles.getIonFractions), in the HDF5 format read by Trident
+
+    Every element is a dataset of log10 ion fractions over
+    (ion, log n_H, [redshift,] log T), with the grid stored in the
+    Parameter1, [Parameter2] and Temperature attributes. The tables are
+    interpolated once to the requested redshift and kept in memory as
+    compact float32 arrays over log n_H and log T (requires h5py)
+
+    :filename: string
+
+        Path to the ion-balance HDF5 file
+
+    :redshift: float, optional
+
+        Redshift of the tables (default: 0)
+
+    :elements: list of strings, optional
+
+        Elements to load (default: all)
+
+    """
+
+    def __init__(self, filename, redshift=0.0, elements=None):
+        import h5py
+
+        self.filename = filename
+        self.redshift = redshift
+        self.tables   = {}
+
+        with h5py.File(filename, 'r') as f:
+            if elements is None:
+                elements = list(f.keys())
+
+            for element in elements:
+                dset = f[element]
+                data = dset[()]
+
+                self.lognH = np.asarray(dset.attrs['Parameter1'], dtype=np.float64)
+                self.logT  = np.asarray(dset.attrs['Temperature'], dtype=np.float64)
+
+                if data.ndim == 4:
+                    z = np.asarray(dset.attrs['Parameter2'], dtype=np.float64)
+                    if len(z) > 1:
+                        k = int(np.clip(np.searchsorted(z, redshift) - 1, 0, len(z) - 2))
+                        w = np.clip((redshift - z[k]) / (z[k + 1] - z[k]), 0, 1)
+                        data = (1 - w) * data[:, :, k, :] + w * data[:, :, k + 1, :]
+                    else:
+                        data = data[:, :, 0, :]
+
+                self.tables[element] = np.maximum(data, -30).astype(np.float32)
+
+    def weights(self, nH, T):
+        """
+
+        Bilinear interpolation weights of every cell, shared by all the ions
+
+        :nH: numpy array, hydrogen number density (cm^-3)
+
+        :T: numpy array, temperature (K)
+
+        :return: flat table indices of the four corners, weights along log n_H and log T
+
+        """
+        indices = []
+        weights = []
+        for grid, values in zip([self.lognH, self.logT], [nH, T]):
+            x = np.log10(np.asarray(values, dtype=np.float64).reshape(-1, order='F'))
+            np.clip(x, grid[0], grid[-1], out=x)
+
+            i = np.searchsorted(grid, x, side='right') - 1
+            np.clip(i, 0, len(grid) - 2, out=i)
+
+            w = (x - grid[i]) / (grid[i + 1] - grid[i])
+
+            indices.append(i.astype(np.int32))
+            weights.append(w.astype(np.float32))
+
+        i, j = indices
+        nT = len(self.logT)
+        corner = i * nT + j
+
+        return corner, weights[0], weights[1]
+
+    def interpolate(self, element, ion, weights):
+        """
+
+        Ion fraction of every cell
+
+        :element: string, e.g. O
+
+        :ion: int, ionisation state (1 for neutral, 6 for O VI)
+
+        :weights: output of weights()
+
+        :return: flat float32 numpy array of ion fractions
+
+        """
+        corner, wn, wt = weights
+        table = self.tables[element][ion - 1].ravel()
+        nT = len(self.logT)
+
+        f00 = table[corner]
+        f01 = table[corner + 1]
+        f10 = table[corner + nT]
+        f11 = table[corner + nT + 1]
+
+        logf = (1 - wn) * ((1 - wt) * f00 + wt * f01) + wn * ((1 - wt) * f10 + wt * f11)
+
+        return np.power(np.float32(10), logf, out=logf)
+
+class IonFractions():
+    """
+
+    Ion fractions and number densities of the cells of a snapshot
+
+    The interpolation weights are computed once per snapshot and every
+    ion is then evaluated with four gathers, and memoised, so all the
+    ions of a snapshot cost one interpolation each
+
+    :table: IonTable
+
+    :rho: numpy array, gas density (g cm^-3)
+
+    :T: numpy array, temperature (K)
+
+    :metallicity: float or numpy array, optional, metallicity in solar units
+
+    """
+
+    def __init__(self, table, rho, T, metallicity=1.0):
+        self.table       = table
+        self.shape       = np.shape(rho)
+        self.metallicity = metallicity
+
+        self.nH = X_H * np.asarray(rho, dtype=np.float64) / M_H
+
+        self._weights   = None
+        self._T         = T
+        self._fractions = {}
+
+    @profiled('ion_weights')
+    def weights(self):
+        if self._weights is None:
+            self._weights = self.table.weights(self.nH, self._T)
+            self._T = None
+
+        return self._weights
+
+    def fraction(self, element, ion):
+        """
+
+        Ion fraction of every cell
+
+        :element: string, e.g. O
+
+        :ion: int, ionisation state (1 for neutral, 6 for O VI)
+
+        :return: numpy array with the shape of the grid
+
+        """
+        key = (element, int(ion))
+        if key not in self._fractions:
+            fraction = self.table.interpolate(element, int(ion), self.weights())
+            self._fractions[key] = fraction.reshape(self.shape, order='F')
+
+        return self._fractions[key]
+
+    def number_density(self, element, ion):
+        """
+
+        Number density of an ion (cm^-3): ion fraction times the number
+        density of the element, scaled by the metallicity for metals
+
+        :return: numpy array with the shape of the grid
+
+        """
+        n = self.fraction(element, ion) * self.nH * SOLAR_ABUNDANCE[element]
+        if element not in ['H', 'He']:
+            n *= self.metallicity
+
+        return n
@@ -8,8 +8,12 @@ import trident
 import numpy as np
 import pandas as pd
 
+from ..profiling import profiled
 from .absorption_spectrum import MockSpectra
 from .column_density import ColumnDensity
+from .ion_table import IonFractions
+from .sightlines import survey, spectra_batch
+from .spectral_cube import spectral_cube, LINES
 
 class SyntheticObservables():
     """
@@ -37,34 +41,98 @@ class SyntheticObservables():
         [2] velocity
         [3] length
 
-    """
+    :ion_table: IonTable, optional
 
-    def __init__(self, fields, shape, ions, units):
+        Ion-fraction tables to evaluate the ion number densities of all
+        the cells at once (default: Trident ion fields)
 
-        mm = 1.660e-24   # 1 amu
-        mu = 6.724418e-1 
-        kb = 1.380e-16   # Boltzmann constant in cgs
+    :lean: bool, optional
 
-        rho = fields[0] * units[0]
-        tr1 = fields[1]
-        prs = fields[2] * units[1]
-        vx1 = fields[3] * units[2]
-        vx2 = fields[4] * units[2]
-        vx3 = fields[5] * units[2]
-        T   = prs * mu * mm / (rho * kb)
+        Build the dataset with as few full-grid arrays as possible: the
+        fields are scaled in place when they are writable arrays of the
+        working precision (so the arrays passed in are modified) or
+        converted once otherwise, the temperature and the (solar)
+        metallicity are yt derived fields evaluated chunk by chunk, and
+        the tracer is not copied
 
-        metal = np.ones((shape[0], shape[1], shape[2]))
-        bbox  = np.array([[-shape[0]/2, shape[0]/2], [0, shape[1]], [-shape[2]/2, shape[2]/2]], dtype=int)
+    :precision: string, optional
+
+        float64 (default) or float32 fields in lean mode
+
+    :nprocs: int, optional
+
+        Number of grids the domain is decomposed into, for parallel yt operations
+
+    """
 
-        data = {
-            ('gas', 'density'): (rho, 'g/c**3'),
-            ('gas', 'temperature'): (T, 'K'),
-            ('gas', 'metallicity'): (metal, 'Zsun'),
-            ('gas', 'velocity_x'): (vx1, 'cm/s'),
-            ('gas', 'velocity_y'): (vx2, 'cm/s'),
-            ('gas', 'velocity_z'): (vx3, 'cm/s')
+    mm = 1.660e-24   # 1 amu
+    mu = 6.724418e-1
+    kb = 1.380e-16   # Boltzmann constant in cgs
+
+    @profiled('synthetic_setup')
+    def __init__(self, fields, shape, ions, units, ion_table=None, lean=False, precision='float64', nprocs=1):
+
+        mm = self.mm
+        mu = self.mu
+        kb = self.kb
+
+        self.lean  = lean
+        self.dtype = np.dtype(precision)
+
+        rho = self._scale(fields[0], units[0])
+        prs = self._scale(fields[2], units[1])
+        vx1 = self._scale(fields[3], units[2])
+        vx2 = self._scale(fields[4], units[2])
+        vx3 = self._scale(fields[5], units[2])
+
+        self.rho = rho
+        self.prs = prs
+        self._T  = None
+
+        self.units     = units
+        self.ion_table = ion_table
+        self.buffers   = {
+            ('gas', 'density'): (rho, 0, units[0]),
+            ('gas', 'pressure'): (prs, 2, units[1]),
+            ('gas', 'velocity_x'): (vx1, 3, units[2]),
+            ('gas', 'velocity_y'): (vx2, 4, units[2]),
+            ('gas', 'velocity_z'): (vx3, 5, units[2])
         }
 
+        bbox  = np.array([[-shape[0]/2, shape[0]/2], [0, shape[1]], [-shape[2]/2, shape[2]/2]], dtype=int)
+
+        if lean:
+            data = {
+                ('gas', 'density'): (rho, 'g/cm**3'),
+                ('gas', 'pressure'): (prs, 'dyne/cm**2'),
+                ('gas', 'velocity_x'): (vx1, 'cm/s'),
+                ('gas', 'velocity_y'): (vx2, 'cm/s'),
+                ('gas', 'velocity_z'): (vx3, 'cm/s')
+            }
+        else:
+            T = self.temperature()
+
+            metal = np.ones((shape[0], shape[1], shape[2]))
+
+            data = {
+                ('gas', 'density'): (rho, 'g/cm**3'),
+                ('gas', 'temperature'): (T, 'K'),
+                ('gas', 'metallicity'): (metal, 'Zsun'),
+                ('gas', 'velocity_x'): (vx1, 'cm/s'),
+                ('gas', 'velocity_y'): (vx2, 'cm/s'),
+                ('gas', 'velocity_z'): (vx3, 'cm/s')
+            }
+
+        self.densities = None
+        if ion_table is not None:
+            fractions = IonFractions(ion_table, rho, self.temperature())
+
+            self.densities = {}
+            for element, ionnum in zip(ions[:, 0], ions[:, 1].astype(int)):
+                species = element + '_p' + str(ionnum - 1)
+                self.densities[species] = fractions.number_density(element, ionnum)
+                data[('gas', species + '_number_density')] = (self.densities[species], 'cm**-3')
+
         length   = units[3] * 0.039
         mass     = units[0] * length**3
         velocity = units[2]
@@ -74,14 +142,29 @@ class SyntheticObservables():
                                   mass_unit = (mass, 'g'),
                                   velocity_unit = (velocity, 'cm.s'),
                                   bbox = bbox,
-                                  nprocs = 1)
+                                  nprocs = nprocs)
+
+        if lean:
+            def _temperature(field, data):
+                return data['gas', 'pressure'] / data['gas', 'density'] * data.ds.quan(mu * mm / kb, 'g*K/erg')
+
+            def _metallicity(field, data):
+                return data.ds.arr(np.ones(data['gas', 'density'].shape, dtype=self.dtype), 'Zsun')
+
+            ds.add_field(('gas', 'temperature'), function=_temperature, units='K',
+                         sampling_type='cell', force_override=True)
+            ds.add_field(('gas', 'metallicity'), function=_metallicity, units='Zsun',
+                         sampling_type='cell', force_override=True)
         
-        trident.add_ion_fields(ds, ions=ions[:, 0], ftype='gas')
+        if ion_table is None:
+            trident.add_ion_fields(ds, ions=ions[:, 0], ftype='gas')
 
         self.ds    = ds
         self.shape = shape
         self.ions  = ions
 
+        self.vy = vx2
+
         obs_path = './observables/'
 
         if os.path.isdir(obs_path):
@@ -89,32 +172,230 @@ class SyntheticObservables():
         else:
             os.mkdir(obs_path)
 
-    def get_column_densities(self):
+        self.obs = obs_path
+
+        self._spectra = None
+
+    @profiled('synthetic_swap')
+    def swap(self, fields, obs=None):
+        """
+
+        Swap the fields of another snapshot of the same simulation into
+        the buffers of the dataset, so that the dataset, the ion fields
+        and the ion tables are set up only once for a time series
+
+        :fields: numpy array
+
+            Scalar/vector fields from a VTK simulation file
+
+        :obs: string, optional
+
+            Directory of the outputs of this snapshot
+
+        """
+        for field, (buffer, i, unit) in self.buffers.items():
+            np.multiply(fields[i], unit, out=buffer, casting='unsafe')
+            self._push(field, buffer)
+
+        if self._T is not None:
+            np.multiply(self.prs, self.mu * self.mm / self.kb, out=self._T)
+            np.divide(self._T, self.rho, out=self._T)
+            if not self.lean:
+                self._push(('gas', 'temperature'), self._T)
+
+        if self.densities is not None:
+            fractions = IonFractions(self.ion_table, self.rho, self.temperature())
+            for element, ionnum in zip(self.ions[:, 0], self.ions[:, 1].astype(int)):
+                species = element + '_p' + str(ionnum - 1)
+                np.copyto(self.densities[species], fractions.number_density(element, ionnum), casting='unsafe')
+                self._push(('gas', species + '_number_density'), self.densities[species])
+
+        for grid in self.ds.index.grids:
+            grid.clear_data()
+
+        if obs is not None:
+            if os.path.isdir(obs):
+                None
+            else:
+                os.makedirs(obs)
+
+            self.obs = obs
+
+    def _push(self, field, buffer):
+        """
+
+        Copy a buffer into the grids of the dataset, unless they share its memory
+
+        """
+        for grid in self.ds.index.grids:
+            gfields = self.ds.stream_handler.fields[grid.id]
+            if field not in gfields or np.shares_memory(gfields[field], buffer):
+                continue
+
+            stored = gfields[field]
+
+            i0 = grid.get_global_startindex()
+            n  = grid.ActiveDimensions
+            stored.view(np.ndarray)[...] = buffer[i0[0]:i0[0] + n[0], i0[1]:i0[1] + n[1], i0[2]:i0[2] + n[2]]
+
+    def _scale(self, field, unit):
+        """
+
+        Field in cgs units: a scaled copy, or in lean mode the field
+        scaled in place (writable arrays of the working precision) or
+        converted once to the working precision
+
+        """
+        if not self.lean:
+            return field * unit
+
+        if isinstance(field, np.ndarray) and field.flags.writeable and field.dtype == self.dtype \
+                and not isinstance(field, np.memmap):
+            field *= unit
+            return field
+
+        out = np.empty(np.shape(field), dtype=self.dtype, order='F')
+        np.multiply(field, unit, out=out, casting='unsafe')
+        return out
+
+    def temperature(self):
+        """
+
+        Temperature of every cell (K), computed on first use
+
+        """
+        if self._T is None:
+            self._T = self.prs * self.mu * self.mm / (self.rho * self.kb)
+
+        return self._T
+
+    def get_column_densities(self, engine='native', columns='binary', compression=None, levels=(1, 2, 4, 8),
+                             dtype='float64'):
         """
 
         Get down-the-barrel and transverse column density maps
+
+        :engine: string, optional, native (default) or yt, see ColumnDensity
+
+        :columns: string, optional, binary (default, one ColumnStore archive
+                  with all the maps) or text (one file per ion and view)
+
+        :compression: string, optional, None (default) or zlib, binary maps only
+
+        :levels: tuple of ints, optional, block sizes of the binary levels
+
+        :dtype: string, optional, precision of the binary maps (float64 or float32)
         
         """
-        cols = ColumnDensity(self.ds, self.shape, self.ions)
-        cols.projXZ()
-        cols.projYZ()
+        if columns not in ['binary', 'text']:
+            raise Exception('Column density outputs: binary, text')
+
+        cols = ColumnDensity(self.ds, self.shape, self.ions, engine, self.densities)
+        cols.obs = self.obs
+
+        if columns == 'binary':
+            cols.archive(compression, levels, dtype=dtype)
+        else:
+            cols.projXZ()
+            cols.projYZ()
 
         print('Column density maps DONE')
 
-    def get_mock_spectra(self):
+    def get_spectral_cube(self, profile='voigt', vmin=-500, vmax=0, dv=1, memory=2**28):
+        """
+
+        Get down-the-barrel absorption spectra of every column of the grid
+        (along y) as one (nx, nz, nvel) flux cube per ion
+
+        :profile: string, optional, voigt (default) or gaussian
+
+        :vmin: float, optional, lowest velocity (km/s)
+
+        :vmax: float, optional, highest velocity (km/s)
+
+        :dv: float, optional, velocity resolution (km/s)
+
+        :memory: int, optional, bytes of temporary arrays per chunk of cells
+
+        """
+        velocity = np.arange(vmin, vmax + dv / 2, dv)
+        dl = float(self.ds.domain_width[1].in_units('cm')) / self.shape[1]
+
+        cols = ColumnDensity(self.ds, self.shape, self.ions, densities=self.densities)
+        densities = cols.densities()
+
+        for species, element, roman in zip(cols.ions, self.ions[:, 0], self.ions[:, 2]):
+            ion = element + ' ' + roman
+            if ion not in LINES:
+                raise Exception('No line data for ' + ion + ', add it to spectral_cube.LINES')
+
+            n = densities[species]
+            if callable(n):
+                n = n(0, self.shape[2])
+
+            tau = spectral_cube(n, self.temperature(), self.vy, dl, LINES[ion], velocity, profile, memory=memory)
+            np.savez(self.obs + element + roman + '_cube.npz', velocity=velocity, flux=np.exp(-tau))
+
+        print('Spectral cubes DONE')
+
+    def get_mock_spectra(self, sightlines=None, workers=1, batch=64):
         """
 
-        Get absorption spectra for three default rays
+        Get absorption spectra for three default rays, or for a grid of sightlines
+
+        :sightlines: tuple, optional
+
+            Names, start and end points of the sightlines (see sightline_grid)
+
+        :workers: int, optional, number of worker processes for the sightlines
+
+        :batch: int, optional, number of sightlines per output file
         
         """
-        spectra = MockSpectra(self.ds, self.shape, self.ions)
+        spectra = self._mock_spectra()
+
+        if sightlines is not None:
+            survey(spectra, *sightlines, workers=workers, batch=batch)
+            print('Mock absorption spectra DONE')
+            return
 
         rays = []
         rays.append(spectra.raymaker('r1', [0, 0, 0], [0, self.shape[1], 0]))
         rays.append(spectra.raymaker('r2', [8, 0, 0], [8, self.shape[1], 0]))
         rays.append(spectra.raymaker('r3', [16, 0, 0], [16, self.shape[1], 0]))
 
-        for i in range(1, 4):
-            spectra.getSpectrum(rays[i], 'r' + str(i))
+        for i in range(3):
+            spectra.getSpectrum(rays[i], 'r' + str(i + 1))
         
-        print('Mock absorption spectra DONE')
\ No newline at end of file
+        print('Mock absorption spectra DONE')
+
+    def get_spectra_batch(self, names, starts, ends):
+        """
+
+        Spectra of every ion along a batch of sightlines, e.g. for a
+        task of the work queue
+
+        :names: numpy array of strings, names of the sightlines
+
+        :starts: numpy array, start points of the sightlines
+
+        :ends: numpy array, end points of the sightlines
+
+        :return: velocity, dict of fluxes by ion (one row per sightline)
+
+        """
+        return spectra_batch(self._mock_spectra(), names, starts, ends)
+
+    def _mock_spectra(self):
+        """
+
+        MockSpectra of the dataset, kept with its spectrum generators
+        across snapshots and batches
+
+        """
+        if self._spectra is None:
+            self._spectra = MockSpectra(self.ds, self.shape, self.ions)
+
+        self._spectra.obs = self._spectra.raypath = self.obs
+
+        return self._spectra
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ..profiling import PROFILER
+
+def sightline_grid(shape, kind='regular', step=1, n=None, seed=0, filename=None):
+    """
+
+    Sightlines along y (down the barrel) across the computational box,
+    in the coordinates of the yt dataset (x in [-nx/2, nx/2], y in
+    [0, ny], z in [-nz/2, nz/2])
+
+    **Parameters**
+
+    :shape: tuple, dimensions of the computational box
+
+    :kind: string, optional
+
+        regular: a grid of sightlines every step cells in x and z,
+        through the cell centres
+        random: n sightlines at uniformly random x, z
+        file: sightlines read from a text file, one per row, either
+        x z (along y) or x0 y0 z0 x1 y1 z1
+
+    :step: int, optional, spacing of the regular grid in cells
+
+    :n: int, optional, number of random sightlines
+
+    :seed: int, optional, seed of the random sightlines
+
+    :filename: string, optional, file of the sightlines
+
+    :return: names, start points, end points (numpy arrays)
+
+    """
+    nx, ny, nz = shape
+
+    if kind == 'regular':
+        x = np.arange(-nx / 2 + 0.5, nx / 2, step)
+        z = np.arange(-nz / 2 + 0.5, nz / 2, step)
+        x, z = [a.ravel() for a in np.meshgrid(x, z, indexing='ij')]
+
+    elif kind == 'random':
+        if n is None:
+            raise Exception('Set the number of random sightlines')
+
+        rng = np.random.default_rng(seed)
+        x = rng.uniform(-nx / 2, nx / 2, n)
+        z = rng.uniform(-nz / 2, nz / 2, n)
+
+    elif kind == 'file':
+        rows = np.loadtxt(filename, ndmin=2)
+        if rows.shape[1] == 6:
+            names = np.array(['s' + str(i) for i in range(len(rows))])
+            return names, rows[:, :3], rows[:, 3:]
+
+        x, z = rows[:, 0], rows[:, 1]
+
+    else:
+        raise Exception('Sightline grids: regular, random, file')
+
+    start = np.stack([x, np.zeros_like(x), z], axis=1)
+    end   = np.stack([x, np.full_like(x, ny), z], axis=1)
+    names = np.array(['s' + str(i) for i in range(len(x))])
+
+    return names, start, end
+
+_spectra = None
+
+def _init_worker(spectra, profile):
+    """
+
+    Keep the MockSpectra instance, with its dataset and one spectrum
+    generator per ion, in the worker for all its sightlines
+
+    """
+    global _spectra
+    _spectra = spectra
+    _spectra.raypath = spectra.obs + 'rays_' + str(os.getpid()) + '_'
+
+    PROFILER.enabled = profile
+
+def _batch(names, starts, ends):
+    """
+
+    Extract the rays of a batch of sightlines and compute their spectra
+
+    """
+    fluxes = {ion: [] for ion in _spectra.ions}
+    velocity = None
+
+    for name, start, end in zip(names, starts, ends):
+        PROFILER.snapshot = name
+
+        ray = _spectra.raymaker(name, list(start), list(end), verbose=False)
+        for ion, (velocity, flux) in _spectra.spectra(ray).items():
+            fluxes[ion].append(flux)
+
+        if os.path.isfile(_spectra.raypath + 'ray_' + name + '.h5'):
+            os.remove(_spectra.raypath + 'ray_' + name + '.h5')
+
+    return velocity, {ion: np.array(flux) for ion, flux in fluxes.items()}, PROFILER.drain()
+
+def spectra_batch(spectra, names, starts, ends):
+    """
+
+    Spectra of every ion along a batch of sightlines, in this process
+
+    :spectra: MockSpectra
+
+    :names: numpy array of strings, names of the sightlines
+
+    :starts: numpy array, start points of the sightlines
+
+    :ends: numpy array, end points of the sightlines
+
+    :return: velocity, dict of fluxes by ion (one row per sightline)
+
+    """
+    raypath = spectra.raypath
+    try:
+        _init_worker(spectra, PROFILER.enabled)
+        velocity, fluxes, events = _batch(names, starts, ends)
+    finally:
+        spectra.raypath = raypath
+
+    PROFILER.events.extend(events)
+
+    return velocity, fluxes
+
+def write_batch(obs, b, names, starts, ends, velocity, fluxes):
+    """
+
+    Write the spectra of a batch of sightlines, one file per ion
+    (obs/spectra_<ion>_<batch>.npz)
+
+    :obs: string, output directory
+
+    :b: int, number of the batch
+
+    """
+    for ion, flux in fluxes.items():
+        np.savez(obs + 'spectra_' + ion.replace(' ', '') + '_' + str(b).zfill(4) + '.npz',
+                 names=names, start=starts, end=ends, velocity=velocity, flux=flux)
+
+def survey(spectra, names, starts, ends, workers=1, batch=64):
+    """
+
+    Mock absorption spectra of every ion along a set of sightlines,
+    spread over a pool of worker processes
+
+    The sightlines are processed in batches and every worker keeps its
+    dataset and spectrum generators across batches. The dataset is
+    inherited by the workers (fork), not sent to them. The spectra of
+    every batch are written to observables/spectra_<ion>_<batch>.npz
+    (names, start, end, velocity, flux with one row per sightline)
+
+    **Parameters**
+
+    :spectra: MockSpectra
+
+    :names: numpy array of strings, names of the sightlines
+
+    :starts: numpy array, start points of the sightlines
+
+    :ends: numpy array, end points of the sightlines
+
+    :workers: int, optional, number of worker processes
+
+    :batch: int, optional, number of sightlines per batch
+
+    :return: number of batches written
+
+    """
+    batches = [slice(i, i + batch) for i in range(0, len(names), batch)]
+
+    def write(b, velocity, fluxes):
+        sl = batches[b]
+        write_batch(spectra.obs, b, names[sl], starts[sl], ends[sl], velocity, fluxes)
+
+    if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(spectra, PROFILER.enabled)) as pool:
+            futures = [pool.submit(_batch, names[sl], starts[sl], ends[sl]) for sl in batches]
+
+            for b, future in enumerate(futures):
+                velocity, fluxes, events = future.result()
+                PROFILER.events.extend(events)
+                write(b, velocity, fluxes)
+                print(f'Batch {b + 1} out of {len(batches)} done')
+    else:
+        for b, sl in enumerate(batches):
+            velocity, fluxes = spectra_batch(spectra, names[sl], starts[sl], ends[sl])
+            write(b, velocity, fluxes)
+            print(f'Batch {b + 1} out of {len(batches)} done')
+
+    return len(batches)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from ..profiling import profiled
+
+# Strongest transition of common ions: rest wavelength (Angstrom),
+# oscillator strength, damping constant (s^-1), atomic mass (amu)
+LINES = {
+    'H I':    (1215.670, 0.4164, 6.265e8, 1.00794),
+    'C II':   (1334.532, 0.1278, 2.880e8, 12.0107),
+    'C IV':   (1548.204, 0.1899, 2.642e8, 12.0107),
+    'N V':    (1238.821, 0.1560, 3.400e8, 14.0067),
+    'O I':    (1302.168, 0.0480, 3.410e8, 15.9994),
+    'O VI':   (1031.912, 0.1325, 4.163e8, 15.9994),
+    'Ne VIII': (770.409, 0.1030, 5.790e8, 20.1797),
+    'Mg II':  (2796.354, 0.6155, 2.625e8, 24.3050),
+    'Si II':  (1260.422, 1.1800, 2.950e9, 28.0855),
+    'Si III': (1206.500, 1.6700, 2.530e9, 28.0855),
+    'Si IV':  (1393.760, 0.5130, 8.800e8, 28.0855)
+}
+
+SIGMA = 2.654e-2    # pi e^2 / (m_e c) in cm^2 s^-1
+KB    = 1.380e-16   # Boltzmann constant in cgs
+AMU   = 1.660e-24   # 1 amu in g
+
+def erf(x):
+    """
+
+    Vectorized error function (Abramowitz & Stegun 7.1.26, |error| < 1.5e-7)
+
+    """
+    s = np.sign(x)
+    x = np.abs(x)
+    t = 1 / (1 + 0.3275911 * x)
+    y = 1 - t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429)))) * np.exp(-x * x)
+
+    return s * y
+
+def voigt(a, x):
+    """
+
+    Voigt-Hjerting function H(a, x) (Tepper-Garcia 2006 approximation,
+    as used by Trident)
+
+    :a: numpy array, damping parameter
+
+    :x: numpy array, offset from the line centre in Doppler widths
+
+    """
+    x2 = np.maximum(x * x, 1e-4)
+    h0 = np.exp(-x2)
+    q  = 1.5 / x2
+
+    return h0 - a / np.sqrt(np.pi) / x2 * (h0 * h0 * (4 * x2 * x2 + 7 * x2 + 4 + q) - q - 1)
+
+@profiled('spectral_cube')
+def spectral_cube(n, T, v, dl, line, velocity, profile='voigt', axis=1, tau_min=1e-6, chunk=None, memory=2**28):
+    """
+
+    Optical depth in velocity space of every sightline of a uniform grid
+    along one of its axes, for all the sightlines at once
+
+    Every cell adds the line profile of its column (n dl) at its line-of-sight
+    velocity, with thermal broadening. The observer sits at the far end of the
+    sightlines, so gas moving along the axis towards it is blueshifted.
+    The Gaussian core of the profiles is averaged over the velocity bins,
+    so lines narrower than a bin keep their column density; the damping
+    wings of Voigt profiles, which vary slowly, are sampled at the bin
+    centres. Cells whose peak optical depth is below tau_min are skipped
+
+    **Parameters**
+
+    :n: numpy array, number density of the ion (cm^-3)
+
+    :T: numpy array, temperature (K)
+
+    :v: numpy array, velocity along the axis (cm/s)
+
+    :dl: float, cell length along the axis (cm)
+
+    :line: tuple, rest wavelength (Angstrom), oscillator strength,
+           damping constant (s^-1) and atomic mass (amu), see LINES
+
+    :velocity: numpy array, centres of the velocity bins (km/s), evenly spaced
+
+    :profile: string, optional, voigt (default) or gaussian
+
+    :axis: int, optional, axis of the sightlines (default: y)
+
+    :tau_min: float, optional, peak optical depth below which cells are skipped
+
+    :chunk: int, optional, number of cells evaluated at a time
+            (default: as many as fit in memory)
+
+    :memory: int, optional, bytes of temporary arrays per chunk (default: 256 MB)
+
+    :return: float32 numpy array of optical depths, with the two other axes
+             of the grid first and velocity last, e.g. (nx, nz, nvel) along y
+
+    """
+    if profile not in ['voigt', 'gaussian']:
+        raise Exception('Line profiles: voigt, gaussian')
+
+    lambda0, f, gamma, mass = line
+    lambda0 = lambda0 * 1e-8
+
+    shape = [s for i, s in enumerate(np.shape(n)) if i != axis]
+    vel   = np.asarray(velocity, dtype=np.float64) * 1e5
+    dv    = vel[1] - vel[0] if len(vel) > 1 else 1.0
+
+    cube = np.zeros((shape[0] * shape[1], len(vel)), dtype=np.float32)
+
+    # about eight float64 (cells, nvel) temporaries are alive at a time
+    if chunk is None:
+        chunk = max(1, int(memory) // (8 * 8 * len(vel)))
+
+    for j in range(np.shape(n)[axis]):
+        sl = [slice(None)] * 3
+        sl[axis] = j
+        sl = tuple(sl)
+
+        N = np.asarray(n[sl], dtype=np.float64).reshape(-1) * dl
+        b = np.sqrt(2 * KB * np.asarray(T[sl], dtype=np.float64).reshape(-1) / (mass * AMU))
+        c = -np.asarray(v[sl], dtype=np.float64).reshape(-1)
+
+        tau0 = SIGMA * f * lambda0 * N
+        keep = np.nonzero(tau0 / (np.sqrt(np.pi) * b) > tau_min)[0]
+
+        for i0 in range(0, len(keep), chunk):
+            idx = keep[i0:i0 + chunk]
+            bi  = b[idx, None]
+            x   = (vel[None, :] - c[idx, None]) / bi
+
+            h = dv / bi / 2
+            phi = (erf(x + h) - erf(x - h)) / (2 * dv)
+
+            if profile == 'voigt':
+                a = gamma * lambda0 / (4 * np.pi * bi)
+                phi += (voigt(a, x) - np.exp(-x * x)) / (np.sqrt(np.pi) * bi)
+
+            cube[idx] += (tau0[idx, None] * phi).astype(np.float32)
+
+    return cube.reshape(shape[0], shape[1], len(vel))
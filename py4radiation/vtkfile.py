@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+VTK_TYPES = {
+    'char': 'i1',
+    'unsigned_char': 'u1',
+    'short': '>i2',
+    'unsigned_short': '>u2',
+    'int': '>i4',
+    'unsigned_int': '>u4',
+    'long': '>i8',
+    'unsigned_long': '>u8',
+    'float': '>f4',
+    'double': '>f8'
+}
+
+class VTKFile():
+    """
+
+    Native reader for PLUTO binary legacy VTK files (.vtk and .dat outputs)
+
+    The header is parsed once and every data block is memory-mapped
+    at its byte offset, so arrays are returned as zero-copy big-endian
+    views that are only paged in from disk when they are accessed
+
+    :filename: string
+
+        Path to simulation file
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        self.arrays = {}
+        self.coords = {}
+        self.dims   = None
+
+        with open(filename, 'rb') as f:
+            self._parse(f)
+
+        self.shape = tuple(max(d - 1, 1) for d in self.dims)
+
+    def _parse(self, f):
+        """
+
+        Scan the header and record the offset, dtype and number of
+        components of every data block without reading the data
+
+        :f: file object, opened in binary mode
+
+        """
+        f.readline()
+        f.readline()
+
+        fmt = f.readline().strip().upper()
+        if fmt != b'BINARY':
+            raise Exception('Only BINARY legacy VTK files are supported: ' + self.filename)
+
+        section = None
+
+        while True:
+            line = f.readline()
+            if not line:
+                break
+
+            words = line.split()
+            if not words:
+                continue
+
+            key = words[0].decode().upper()
+
+            if key == 'DATASET':
+                self.dataset = words[1].decode().upper()
+
+            elif key == 'DIMENSIONS':
+                self.dims = tuple(int(w) for w in words[1:4])
+
+            elif key in ('X_COORDINATES', 'Y_COORDINATES', 'Z_COORDINATES'):
+                npts  = int(words[1])
+                dtype = np.dtype(VTK_TYPES[words[2].decode()])
+                self.coords[key[0].lower()] = (f.tell(), dtype, npts)
+                f.seek(npts * dtype.itemsize, 1)
+
+            elif key == 'POINTS':
+                npts  = int(words[1])
+                dtype = np.dtype(VTK_TYPES[words[2].decode()])
+                f.seek(3 * npts * dtype.itemsize, 1)
+
+            elif key == 'CELL_DATA' or key == 'POINT_DATA':
+                section = key
+                ntuples = int(words[1])
+
+            elif key == 'FIELD':
+                for _ in range(int(words[2])):
+                    words = f.readline().split()
+                    while not words:
+                        words = f.readline().split()
+
+                    name   = words[0].decode()
+                    ncomp  = int(words[1])
+                    ntup   = int(words[2])
+                    dtype  = np.dtype(VTK_TYPES[words[3].decode()])
+                    offset = f.tell()
+                    f.seek(ncomp * ntup * dtype.itemsize, 1)
+
+                    if section == 'CELL_DATA':
+                        self.arrays[name] = (offset, dtype, ncomp)
+
+            elif key == 'SCALARS':
+                name  = words[1].decode()
+                dtype = np.dtype(VTK_TYPES[words[2].decode()])
+                ncomp = int(words[3]) if len(words) > 3 else 1
+
+                f.readline()
+                offset = f.tell()
+                f.seek(ncomp * ntuples * dtype.itemsize, 1)
+
+                if section == 'CELL_DATA':
+                    self.arrays[name] = (offset, dtype, ncomp)
+
+            elif key == 'VECTORS':
+                name   = words[1].decode()
+                dtype  = np.dtype(VTK_TYPES[words[2].decode()])
+                offset = f.tell()
+                f.seek(3 * ntuples * dtype.itemsize, 1)
+
+                if section == 'CELL_DATA':
+                    self.arrays[name] = (offset, dtype, 3)
+
+        if self.dims is None:
+            raise Exception('No DIMENSIONS found in ' + self.filename)
+
+    def subbox(self, box=None):
+        """
+
+        Convert a sub-box into a tuple of slices over the cell indices
+
+        :box: tuple of slices or list of [start, stop] index pairs, optional
+
+            One entry per axis, None selects the whole axis
+
+        :return: tuple of slices, shape of the sub-box
+
+        """
+        if box is None:
+            box = [None] * 3
+
+        slices = []
+        for lims, n in zip(box, self.shape):
+            if lims is None:
+                lims = slice(None)
+            elif not isinstance(lims, slice):
+                lims = slice(int(lims[0]), int(lims[1]))
+
+            slices.append(slice(*lims.indices(n)))
+
+        shape = tuple(len(range(sl.start, sl.stop, sl.step)) for sl in slices)
+
+        return tuple(slices), shape
+
+    def field(self, name, box=None):
+        """
+
+        Memory-map a single CELL_DATA array
+
+        :name: string
+
+            Name of the array, e.g. rho, tr1, prs, vx1, vx2, vx3
+
+        :box: tuple of slices or list of [start, stop] index pairs, optional
+
+            Sub-box of the computational domain, only the pages
+            covering it are read from disk
+
+        :return: numpy memmap with the dimensions of the box (Fortran order),
+                 with an extra leading axis for multi-component arrays
+
+        """
+        if name not in self.arrays:
+            raise Exception('Field ' + name + ' not found in ' + self.filename)
+
+        offset, dtype, ncomp = self.arrays[name]
+        count = int(np.prod(self.shape)) * ncomp
+
+        data = np.memmap(self.filename, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+        slices, _ = self.subbox(box)
+
+        if ncomp == 1:
+            return data.reshape(self.shape, order='F')[slices]
+
+        return data.reshape((ncomp,) + self.shape, order='F')[(slice(None),) + slices]
+
+    def datasize(self, names=None):
+        """
+
+        Size in bytes the file must have to hold the given arrays in full,
+        used to tell whether a file still being written is complete
+
+        :names: list of strings, optional
+
+            Names of the arrays (default: all the CELL_DATA arrays found)
+
+        """
+        if names is None:
+            names = list(self.arrays)
+
+        end = 0
+        for name in names:
+            if name not in self.arrays:
+                return None
+
+            offset, dtype, ncomp = self.arrays[name]
+            end = max(end, offset + int(np.prod(self.shape)) * ncomp * dtype.itemsize)
+
+        return end
+
+    def coordinates(self, axis):
+        """
+
+        Memory-map the node coordinates of a rectilinear grid
+
+        :axis: string, x, y or z
+
+        """
+        offset, dtype, npts = self.coords[axis]
+        return np.memmap(self.filename, dtype=dtype, mode='r', offset=offset, shape=(npts,))
+
+    def slabs(self, names, nz):
+        """
+
+        Read scalar CELL_DATA arrays in z-slabs, so that only one slab
+        of every array is held in memory at a time
+
+        :names: list of strings
+
+            Names of the arrays
+
+        :nz: int
+
+            Number of z-planes per slab
+
+        :return: generator of (index of the first z-plane, list of arrays)
+
+        """
+        nx, ny, nztot = self.shape
+
+        for name in names:
+            if self.arrays[name][2] != 1:
+                raise Exception('Only scalar fields can be read in slabs: ' + name)
+
+        with open(self.filename, 'rb') as f:
+            for k0 in range(0, nztot, nz):
+                nk = min(nz, nztot - k0)
+
+                data = []
+                for name in names:
+                    offset, dtype, _ = self.arrays[name]
+                    f.seek(offset + k0 * nx * ny * dtype.itemsize)
+                    slab = np.fromfile(f, dtype=dtype, count=nx * ny * nk)
+                    data.append(slab.reshape((nx, ny, nk), order='F'))
+
+                yield k0, data
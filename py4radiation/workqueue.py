@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import socket
+import threading
+import traceback
+from contextlib import contextmanager
+
+import numpy as np
+
+class WorkQueue():
+    """
+
+    Work queue in a shared directory, for running several workers on
+    one or more nodes without a batch-scheduler integration
+
+    Every task is a JSON file in tasks/. A worker claims a task by
+    creating its lock file in locks/ with O_CREAT | O_EXCL, which only
+    one worker can do, and touches the lock every heartbeat seconds
+    while it works on it. A lock that has not been touched for stale
+    seconds belongs to a dead worker and is reclaimed by the next
+    worker looking for work. Results are written atomically to
+    results/, one .npz file per task, for a final reduce step. Failed
+    tasks are logged in errors/ and retried up to maxtries times
+
+    The directory must be on a filesystem with atomic exclusive
+    creation and rename (any local filesystem, NFSv3 or later, Lustre, GPFS)
+
+    :path: string
+
+        Path to the queue directory
+
+    :stale: float, optional
+
+        Seconds without heartbeat after which a task is reclaimed
+
+    :heartbeat: float, optional
+
+        Seconds between heartbeats
+
+    :maxtries: int, optional
+
+        Attempts of a task before it is given up
+
+    """
+
+    dirs = ['tasks', 'locks', 'results', 'errors']
+
+    def __init__(self, path, stale=120.0, heartbeat=10.0, maxtries=3):
+        self.path      = path
+        self.stale     = stale
+        self.heartbeat = heartbeat
+        self.maxtries  = maxtries
+        self.worker    = socket.gethostname() + ':' + str(os.getpid())
+
+        for d in self.dirs:
+            os.makedirs(os.path.join(path, d), exist_ok=True)
+
+    def _file(self, d, name, ext=''):
+        return os.path.join(self.path, d, name + ext)
+
+    def submit(self, name, spec):
+        """
+
+        Add a task to the queue, unless it is already there
+
+        :name: string, unique name of the task
+
+        :spec: dict, JSON-serialisable description of the task
+
+        :return: True if the task was added
+
+        """
+        task = self._file('tasks', name, '.json')
+        if os.path.isfile(task):
+            return False
+
+        tmp = task + '.' + self.worker.replace(':', '_') + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(spec, f)
+        os.replace(tmp, task)
+
+        return True
+
+    def tasks(self):
+        """
+
+        Names of all the tasks, sorted
+
+        """
+        return sorted(f[:-5] for f in os.listdir(os.path.join(self.path, 'tasks')) if f.endswith('.json'))
+
+    def spec(self, name):
+        with open(self._file('tasks', name, '.json')) as f:
+            return json.load(f)
+
+    def done(self, name):
+        return os.path.isfile(self._file('results', name, '.npz'))
+
+    def tries(self, name):
+        """
+
+        Number of failed attempts of a task
+
+        """
+        try:
+            with open(self._file('errors', name, '.log')) as f:
+                return sum(1 for line in f if line.startswith('### '))
+        except OSError:
+            return 0
+
+    def _reclaim(self, lock):
+        """
+
+        Remove a stale lock, making sure a lock taken over by another
+        worker in the meantime is put back
+
+        """
+        try:
+            stat = os.stat(lock)
+        except FileNotFoundError:
+            return True
+
+        if time.time() - stat.st_mtime < self.stale:
+            return False
+
+        moved = lock + '.' + self.worker.replace(':', '_') + '.stale'
+        try:
+            os.rename(lock, moved)
+        except FileNotFoundError:
+            return True
+
+        if os.stat(moved).st_ino != stat.st_ino:
+            try:
+                os.link(moved, lock)
+            except FileExistsError:
+                None
+            os.remove(moved)
+            return False
+
+        os.remove(moved)
+        return True
+
+    def claim(self):
+        """
+
+        Claim the next available task
+
+        :return: name of the task, or None if no task can be claimed now
+
+        """
+        for name in self.tasks():
+            if self.done(name) or self.tries(name) >= self.maxtries:
+                continue
+
+            lock = self._file('locks', name, '.lock')
+            if os.path.exists(lock) and not self._reclaim(lock):
+                continue
+
+            try:
+                fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.worker + '\n')
+
+            if self.done(name):
+                self.release(name)
+                continue
+
+            return name
+
+        return None
+
+    def release(self, name):
+        """
+
+        Remove the lock of a task, if it still belongs to this worker
+
+        """
+        lock = self._file('locks', name, '.lock')
+        try:
+            with open(lock) as f:
+                owner = f.readline().strip()
+            if owner == self.worker:
+                os.remove(lock)
+        except OSError:
+            None
+
+    @contextmanager
+    def beating(self, name):
+        """
+
+        Touch the lock of a task every heartbeat seconds on a background thread
+
+        """
+        lock = self._file('locks', name, '.lock')
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.heartbeat):
+                try:
+                    os.utime(lock)
+                except OSError:
+                    None
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, name, arrays):
+        """
+
+        Write the result of a task and release it
+
+        :name: string
+
+        :arrays: dict of numpy arrays
+
+        """
+        result = self._file('results', name, '.npz')
+        tmp = result + '.' + self.worker.replace(':', '_') + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, result)
+
+        self.release(name)
+
+    def fail(self, name, error):
+        """
+
+        Log a failed attempt of a task and release it
+
+        """
+        with open(self._file('errors', name, '.log'), 'a') as f:
+            f.write('### ' + self.worker + ' ' + time.strftime('%Y-%m-%dT%H:%M:%S') + '\n')
+            f.write(error + '\n')
+
+        self.release(name)
+
+    def result(self, name):
+        """
+
+        Result of a task
+
+        :return: dict of numpy arrays
+
+        """
+        with np.load(self._file('results', name, '.npz')) as data:
+            return {key: data[key] for key in data.files}
+
+    def status(self):
+        """
+
+        Number of done, failed (given up), running and waiting tasks
+
+        """
+        status = dict.fromkeys(['done', 'failed', 'running', 'waiting'], 0)
+        for name in self.tasks():
+            if self.done(name):
+                status['done'] += 1
+            elif self.tries(name) >= self.maxtries:
+                status['failed'] += 1
+            elif os.path.exists(self._file('locks', name, '.lock')):
+                status['running'] += 1
+            else:
+                status['waiting'] += 1
+
+        return status
+
+    def work(self, handler, poll=5.0):
+        """
+
+        Claim and run tasks until every task is done or given up,
+        waiting for the tasks held by other workers in case they
+        have to be reclaimed
+
+        :handler: function, handler(name, spec) returning a dict of numpy arrays
+
+        :poll: float, optional, seconds between claims while waiting
+
+        :return: generator of the names of the tasks done by this worker
+
+        """
+        while True:
+            name = self.claim()
+
+            if name is None:
+                status = self.status()
+                if status['running'] == 0 and status['waiting'] == 0:
+                    return
+
+                time.sleep(poll)
+                continue
+
+            try:
+                with self.beating(name):
+                    arrays = handler(name, self.spec(name))
+            except Exception:
+                self.fail(name, traceback.format_exc())
+                continue
+
+            self.complete(name, arrays)
+            yield name